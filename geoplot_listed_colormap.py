@@ -8,56 +8,17 @@ Update date: June 4, 2020
 *****************************************************************************************
 """
 
-# import packages
-import numpy as np
-import pandas as pd
-import geopandas as gpd
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib.colors import ListedColormap
-get_ipython().run_line_magic('matplotlib', 'inline')
-
-def geoplot_listed_colormap(gdf,column,bound,ax=None,cmap='Reds',cmap_display=False,fig=None):
-    
-    """ improved geopandas.plot() function, plotting based on discrete listedcmap
-    Params:
-        gdf: geodataframe
-        column: same to gdf.plot(column) 
-        bound: list type, values between vmin and vmax
-        cmap: same to gdf.plot(cmap)
-        cmap_display: show the color bar. If cmap_display=True, fig must add the input.
-    """    
-    # bounds
-    vmin = gdf[column].min()
-    vmax = gdf[column].max()
-    bounds = [vmin] + bound + [vmax]
-    
-    def bound_value(x,bounds):
-        for i,(bmin,bmax) in enumerate(zip(bounds[:-1],bounds[1:])):
-            if i == 0 and x == bmin: return i
-            elif bmin < x <= bmax: return i
-            
-    gdf['csign'] = gdf[column].apply(lambda x: bound_value(x,bounds))
-    
-    # colormap
-    c = mpl.cm.get_cmap(cmap, 256)
-    colors = c(np.linspace(0, 1, len(bounds)-1))
-    cmap = ListedColormap(colors)
-    gdf.plot(ax=ax,column='csign',cmap=cmap)
-    
-    # colorbar
-    if cmap_display:
-        divider = make_axes_locatable(ax)
-        cax = divider.append_axes("right", size="5%", pad=0.1)
-        cbar = fig.colorbar(mappable=mpl.cm.ScalarMappable(cmap=cmap), cax=cax,ticks=np.linspace(0,1,len(bounds)))
-        cbar.ax.set_yticklabels(bounds)  # vertically oriented colorbar
+# the function lives in zython.plot
+from zython.plot import geoplot_listed_colormap
 
 
 
 if __name__ == '__main__':
     """ Example
     """
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    
     # read data
     world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
     
@@ -9,77 +9,15 @@ Update date: June 4, 2020
 """
 
 
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point,Polygon,MultiPolygon
-import shapely
-from shapely import wkt
-import folium
-import matplotlib.pyplot as plt
-get_ipython().run_line_magic('matplotlib', 'inline')
-
-
-
-def gridding(blLoc,urLoc,size,bound=None):
-    """ Segment area into grids
-    Parameters
-    ----------
-    blLoc: bottom left location, "lon,lat"
-    urLoc: upper right location, "lon,lat"
-    size: width of square
-    bound: if set, extract grids within polygon; if not, return all grids within rectangle
-    
-    Retures
-    -------
-    grids: geodataframe
-    """
-    blLon,blLat = blLoc.split(',')
-    urLon,urLat = urLoc.split(',')
-    [blLon,blLat,urLon,urLat] = [float(x) for x in [blLon,blLat,urLon,urLat]]
-    
-    # transform grid size to delta lon and lat
-    deltaLon = size * 360 / (2 * math.pi * 6371004 * math.cos((blLat + urLat) * math.pi / 360))
-    deltaLat = size * 360 / (2 * math.pi * 6371004)
-    numLon = math.ceil((urLon - blLon) / deltaLon)
-    numLat = math.ceil((urLat - blLat) / deltaLat)
-    
-    grids = []
-    for i in range(numLon):
-        for j in range(numLat):
-            blLon_grid = blLon + deltaLon * i
-            blLat_grid = blLat + deltaLat * j
-            urLon_grid = min(blLon + deltaLon * (i + 1), urLon)
-            urLat_grid = min(blLat + deltaLat * (j + 1), urLat)
-            poly = shapely.geometry.box(blLon_grid,blLat_grid,urLon_grid,urLat_grid)
-            poly_wkt = poly.wkt
-            
-            # grids within polygon
-            if bound is not None:
-                # standardize type of bound
-                if type(bound) is gpd.geodataframe.GeoDataFrame:
-                    bound.reset_index(inplace=True)
-                    bound = bound.loc[0,'geometry']
-                elif type(bound) in [shapely.geometry.multipolygon.MultiPolygon,shapely.geometry.polygon.Polygon]:
-                    pass
-                else:
-                    print('Please check the type of bound.')
-                
-                if bound.contains(poly.centroid):
-                    grids.append([i, j, str(blLon_grid) + ',' + str(blLat_grid), str(urLon_grid) + ',' + str(urLat_grid),poly_wkt])
-                else:
-                    continue
-            else:
-                grids.append([i, j, str(blLon_grid) + ',' + str(blLat_grid), str(urLon_grid) + ',' + str(urLat_grid),poly_wkt])
-    
-    grids = pd.DataFrame(grids,columns = ['xid','yid','blc','urc','geometry'])
-    grids['geometry'] = grids['geometry'].apply(wkt.loads)
-    grids = gpd.GeoDataFrame(grids,geometry='geometry')
-    grids.crs = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
-    print('The area is divided into {} grids, {} in rows and {} in columns'.format(len(grids),numLon,numLat))
-    return grids
+# the functions live in zython.grid, they are re-exported here for the scripts importing gridding
+from zython.grid import (GridSpec,GridAggregator,aggregate_file,gridding,standardize_bound,centroid_within,grid_corners,
+                         rasterize_lines,TRAFFIC_STATUS,traffic_grid,gridding_parallel,aggregate_parallel)
 
 
 if __name__ == '__main__':
+    import geopandas as gpd
+    import folium
+    
     # example
     # Nanjing county boundary
     nj_county = gpd.read_file(r'E:\2_Data\南京\行政区划\南京区县区划.shp',encoding='utf-8')
@@ -107,16 +45,10 @@ if __name__ == '__main__':
     folium.LayerControl().add_to(m)
     
     # coordinates to xid and yid
-    def coor_gridID(lon,lat,size=500):
-        """
-        """
-        bl = [118.3567074063469,31.230279326317874]
-        ur = [119.23393839813427,32.61644703874703]
-        deltaLon = size * 360 / (2 * math.pi * 6371004 * math.cos((bl[1] + ur[1]) * math.pi / 360))
-        deltaLat = size * 360 / (2 * math.pi * 6371004)
-        LONCOL = int((lon - bl[0]) / deltaLon)
-        LATCOL = int((lat - bl[1]) / deltaLat)
-        return [LONCOL, LATCOL]
-        
-    #hw['loncol_h'] = hw[['lon_h','lat_h']].apply(lambda r: coor_gridID(r.lon_h,r.lat_h)[0],axis=1)
-    #hw['latcol_h'] = hw[['lon_h','lat_h']].apply(lambda r: coor_gridID(r.lon_h,r.lat_h)[1],axis=1)
+    spec = GridSpec('118.3567074063469,31.230279326317874','119.23393839813427,32.61644703874703',size=500)
+    #hw['loncol_h'],hw['latcol_h'],hw['inside_h'] = spec.gridid(hw['lon_h'].values,hw['lat_h'].values)
+    #hw['gridid_h'] = spec.cellid(hw['lon_h'].values,hw['lat_h'].values)
+    
+    # points per grid and mean speed of a large GPS file, without loading it into memory
+    #agg = aggregate_file(spec,r'E:\2_Data\南京\gps.csv',lon='lon',lat='lat',columns=['speed'])
+    #grids_stat = gridding(blLoc,urLoc,size=500).merge(agg.to_frame(),on=['xid','yid'],how='left')
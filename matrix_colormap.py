@@ -13,7 +13,8 @@ import folium
 from folium.plugins import HeatMap
 import geopandas as gpd
 
-get_ipython().run_line_magic('matplotlib', 'inline')
+from zython.activity import ActivityPatterns,encode,transition_matrices
+from zython.clustering import MarkovClustering
 
 pd.set_option('max_columns',50)
 
@@ -21,39 +22,25 @@ pd.set_option('max_columns',50)
 # In[2]:
 
 
-def encode(data,to_='pat'):
-    """ activity pattern encode transforming between letter and number
-    Parameters
-    ----------
-    data: activity pattern
-    to_:  'pat' or 'num'.
-          'pat' is to transform number to pattern
-          'num' is to transform pattern to number
-    """
-    code = {'H':1,'W':2,'S':3,'E':4,'B':5,'D':6,'R':7,'O':8}
-    code_r = dict((v,k) for k,v in code.items())
-    if to_ == 'num':
-        num = data.applymap(lambda x: code[x])
-        return num
-    elif to_ == 'pat':
-        pat = data.applymap(lambda x: code_r[x])
-        return pat
-
-
 def activity_pattern():
-    """ read activity pattern
+    """ read activity pattern, as a uint8 code matrix with the person ids
     """
     fname = r'E:\8.0 博士研究\R9 出行目的识别\Data process\activity_pattern_noT.csv'
-    actiPattern = pd.read_csv(fname,index_col='PersonID')
+    actiPattern = ActivityPatterns.read_csv(fname,index_col='PersonID')
     return actiPattern
 
 
-def cluster(n):
+def cluster(n,model=None):
     """ clustering results
     Paramter: n, number of classes
+              model: MarkovClustering of the activity patterns, if given the n classes are fitted and
+                     class-{n}.txt is written first
     return:   cls, clustering dataframe
     """
     fname = r'E:\8.0 博士研究\R9 出行目的识别\results\Markov chain based\class-{}.txt'.format(str(n))
+    if model is not None:
+        model.fit(n)
+        model.save_classid(n,fname)
     cls = pd.read_csv(fname, skiprows=1,header=None,names=['idx','classid'])
     return cls
     
@@ -63,16 +50,10 @@ def results(cls):
     Parameter: cls - the clustering result dataframe
     Return: actiPatNum - the multiIndex dataframe, indexes include class no. and person id.
     """
-    # activity pattern
+    # activity pattern, clusters are in the row order of the pattern file
     actiPattern = activity_pattern()
-    actiPatNum = encode(actiPattern,to_='num')
-    
-    # class
-    class_ = sorted(cls.classid.unique())
-    cls['pidx'] = actiPatNum.index
-    cls.set_index('pidx',inplace=True)
-    actiPatNum['c'] = pd.Series(cls.classid)
-    actiPatNum = actiPatNum.sort_values('c').reset_index().set_index(['c','PersonID'])  # multi index
+    actiPattern.classid = cls.classid.values
+    actiPatNum = actiPattern.to_frame()  # multi index
     return actiPatNum
 
 
@@ -80,29 +61,19 @@ def results(cls):
 
 
 def transition_matrix(group):
-    """ 
+    """ transition matrix of the activity patterns (letters) of one group, in percent of all transitions
+    see zython.activity.transition_matrices to get the matrices of all clusters in one pass
     """
-    link = []
-    for idx in group.index.tolist():
-        pat = group.loc[idx].values.tolist()
-        pre = pat[:-1]
-        post = pat[1:]
-        l = list(zip(pre,post))
-        link += l
-
-    link = pd.DataFrame(link,columns=list('st')).reset_index()
-    link = link.groupby(['s','t']).index.count().reset_index()
-    mtr = pd.pivot(link,index='s',columns='t',values='index').fillna(0)
-
-    tm = mtr.reindex(index=list('HWSEBDRO'),columns=list('HWSEBDRO')).fillna(0).astype(int)  # transition matrix
-    #tm = tm.div(tm.sum(axis=0),axis=0).fillna(0).round(3)*100  # rate
-    tm = tm.div(tm.sum().sum()).round(3)*100
-    return tm
+    return transition_matrices(encode(group,to_='num'))[1][0]
 
 
 # In[4]:
 
 
+# in-library clustering, the transition features are computed once for all n
+#model = MarkovClustering(activity_pattern().codes)
+#print(model.sweep([2,3,4,5,6]))  # log-likelihood and BIC of every n
+#cls = cluster(n=3,model=model)
 cls = cluster(n=3)
 class_ = sorted(cls.classid.unique())
 data = results(cls)
@@ -166,9 +137,9 @@ def plot_transition_matrix(ax,data,title,vmin,vmax,cmap_display=True):
 # In[7]:
 
 
-tm1 = transition_matrix(group1)
-tm2 = transition_matrix(group2)
-tm3 = transition_matrix(group3)
+# all clusters in one pass, counts[c] is the 8 x 8 count matrix of class_[c]
+counts,tms = transition_matrices(data.values,data.index.get_level_values('c'))
+tm1,tm2,tm3 = tms[3],tms[1],tms[2]
 
 
 # In[8]:
@@ -0,0 +1,197 @@
+"""
+*****************************************************************************************
+TrafficCrawler against a local stub of the traffic api (url=): token bucket rate, retries and
+sweeps, key retirement and resumption of an interrupted run from the response cache.
+Run from the repository root: python -m pytest tests
+*****************************************************************************************
+"""
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from urllib.parse import urlparse,parse_qs
+
+import pytest
+
+from zython.crawl import TokenBucket,KeyPool,RetryPolicy,ResponseCache,TrafficCrawler
+
+
+def ok(query):
+    """ one road per rectangle
+    """
+    return {'status':'1','info':'OK','infocode':'10000',
+            'trafficinfo':{'roads':[{'name':query['rectangle'],'status':'1','direction':'e','speed':'30',
+                                     'lcodes':[],'polyline':'121.0,31.0;121.001,31.001'}]}}
+
+
+def error(infocode,info='ERROR'):
+    return {'status':'0','info':info,'infocode':infocode}
+
+
+class Stub(object):
+    """ local traffic api, respond(query) builds the json of every request, queries are recorded
+    """
+    def __init__(self):
+        self.respond = ok
+        self.queries = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = {k:v[0] for k,v in parse_qs(urlparse(self.path).query).items()}
+                with stub.lock:
+                    stub.queries.append(query)
+                body = json.dumps(stub.respond(query)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self.url = 'http://127.0.0.1:{}/traffic'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    s = Stub()
+    yield s
+    s.close()
+
+
+def make_tasks(n,level=5):
+    return [(i,'121.{:03d},31.000'.format(i),'121.{:03d},31.001'.format(i + 1),level) for i in range(n)]
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(20,capacity=1)
+    t0 = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # the first token is in the bucket, the next 10 come at 20 per second
+    assert 0.45 <= time.monotonic() - t0 < 1.5
+
+
+def test_crawler_respects_qps(stub):
+    crawler = TrafficCrawler('key-000001',qps=10,workers=5,url=stub.url)
+    t0 = time.monotonic()
+    results = list(crawler.run(make_tasks(25)))
+    elapsed = time.monotonic() - t0
+    crawler.close()
+    # a burst of 10 tokens, then 15 requests at 10 per second
+    assert elapsed >= 1.3
+    assert len(results) == 25 and len(stub.queries) == 25
+    assert crawler.coverage() == 1.0
+
+
+def test_retry_and_sweep(stub):
+    failures = {}
+    def respond(query):
+        # 3 failures per rectangle, then success
+        rectangle = query['rectangle']
+        with stub.lock:
+            failures[rectangle] = failures.get(rectangle,0) + 1
+            n = failures[rectangle]
+        if n <= 3:
+            return error('10020','CKQPS_HAS_EXCEEDED_THE_LIMIT')
+        return ok(query)
+    stub.respond = respond
+    tasks = make_tasks(4)
+    policy = RetryPolicy(retries=1,base=0.001,cap=0.01,sweeps=1)
+    crawler = TrafficCrawler('key-000001',qps=1000,workers=2,url=stub.url,policy=policy)
+    results = dict(crawler.run(tasks))
+    crawler.close()
+    # 2 attempts in the first pass, the retry of the sweep succeeds on the 4th request
+    assert all(data['status'] == '1' for data in results.values())
+    assert len(stub.queries) == 4 * 4
+    assert crawler.retries == 4 * 2
+    assert crawler.failed == [] and crawler.coverage() == 1.0
+
+
+def test_failing_task_is_yielded_after_last_sweep(stub):
+    # the level 4 request always fails
+    stub.respond = lambda query: error('10020','CKQPS_HAS_EXCEEDED_THE_LIMIT') if query['level'] == '4' else ok(query)
+    policy = RetryPolicy(retries=1,base=0.001,cap=0.01,sweeps=2)
+    crawler = TrafficCrawler('key-000001',qps=1000,workers=2,url=stub.url,policy=policy)
+    tasks = make_tasks(2) + make_tasks(1,level=4)
+    results = list(crawler.run(tasks))
+    crawler.close()
+    assert len(results) == 3 and results[-1] == (tasks[2],error('10020','CKQPS_HAS_EXCEEDED_THE_LIMIT'))
+    assert crawler.failed == [tasks[2]] and crawler.errors == 1
+    # 2 attempts in each of the 3 passes
+    assert sum(q['level'] == '4' for q in stub.queries) == 6
+    assert crawler.coverage() == pytest.approx(2 / 3)
+
+
+def test_key_retirement(stub):
+    errors = {'bad-key-0001':error('10001','INVALID_USER_KEY'),'quota-key-01':error('10044','USER_DAILY_QUERY_OVER_LIMIT')}
+    stub.respond = lambda query: errors.get(query['key']) or ok(query)
+    pool = KeyPool(['bad-key-0001','quota-key-01','good-key-001'],qps=1000)
+    crawler = TrafficCrawler(pool,workers=1,url=stub.url)
+    results = list(crawler.run(make_tasks(10)))
+    crawler.close()
+    assert all(data['status'] == '1' for _,data in results)
+    assert pool.retired['bad-key-0001'] == float('inf')
+    assert time.time() < pool.retired['quota-key-01'] < float('inf')
+    assert pool.active() == ['good-key-001']
+    # every retired key is tried once, then all requests go to the good key
+    keys = [q['key'] for q in stub.queries]
+    assert keys.count('bad-key-0001') == 1 and keys.count('quota-key-01') == 1
+    assert keys.count('good-key-001') == 10
+
+
+def test_no_keys_left(stub):
+    stub.respond = lambda query: error('10001','INVALID_USER_KEY')
+    crawler = TrafficCrawler('bad-key-0001',workers=1,url=stub.url)
+    results = list(crawler.run(make_tasks(5)))
+    crawler.close()
+    # only the first request is sent, the other tasks fail without network
+    assert len(results) == 5 and len(stub.queries) == 1
+    assert all(data['infocode'] == '10001' for _,data in results)
+    assert crawler.coverage() == 0.0
+
+
+def test_cache_resume(stub,tmp_path):
+    tasks = make_tasks(20)
+    path = str(tmp_path / 'cache.sqlite')
+    # long time bucket, the run does not straddle two buckets
+    cache = ResponseCache(path,bucket=10 ** 6)
+    crawler = TrafficCrawler('key-000001',qps=1000,workers=2,url=stub.url,cache=cache,run='run-1')
+    first = []
+    for task,data in crawler.run(tasks):
+        first.append(task)
+        if len(first) == 5:
+            break  # interrupted
+    crawler.close()
+    cache.close()
+    # the 5th task was taken but the run stopped before it was marked completed
+    cache = ResponseCache(path,bucket=10 ** 6)
+    assert len(cache.done('run-1')) == 4
+    cache.close()
+
+    cache = ResponseCache(path,bucket=10 ** 6)
+    crawler = TrafficCrawler('key-000001',qps=1000,workers=2,url=stub.url,cache=cache,run='run-1')
+    second = [task for task,data in crawler.run(tasks)]
+    crawler.close()
+    # tasks taken before the interruption are skipped, responses fetched but not taken come from the cache
+    done = set(first[:4])
+    assert done.isdisjoint(second) and set(tasks) <= set(first) | set(second)
+    assert len(stub.queries) == len(tasks)
+    assert len(cache.done('run-1')) == len(tasks)
+
+    # offline replay of the completed run
+    crawler = TrafficCrawler('key-000001',url=stub.url,cache=cache,run='run-1',offline=True)
+    replay = dict(crawler.run(tasks))
+    cache.close()
+    assert len(replay) == len(tasks) and all(data['status'] == '1' for data in replay.values())
+    assert len(stub.queries) == len(tasks)
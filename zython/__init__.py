@@ -0,0 +1,57 @@
+"""
+*****************************************************************************************
+zython: crawling of the amap traffic status api, gridding of geographic data and activity patterns.
+
+    transform   coordinate transforms wgs84 <-> gcj02                 numpy
+    traffic     get_traffic, parse_traffic, request planning, dedupe  numpy, shapely, requests
+    grid        GridSpec, gridding, aggregation and rasterization     numpy, shapely
+    crawl       TrafficCrawler, KeyPool, ResponseCache, scheduler     + threads, sqlite3
+    metrics     CrawlMetrics, json and prometheus export
+    storage     TrafficWriter, read_traffic, TrafficStore             pandas, geopandas, pyarrow
+    activity    activity patterns, transitions, n-gram counts         numpy
+    clustering  Markov chain mixture clustering of activity patterns  numpy
+    plot        geoplot_listed_colormap, classify                     matplotlib
+    shared      numpy arrays in shared memory for the process pools   numpy
+    cli         python -m zython
+
+Importing zython imports none of them: the names below are looked up in their module on first
+access, and pandas / geopandas / matplotlib are imported by the functions that build frames or
+plots. A crawl from the command line therefore starts with numpy, shapely and requests only.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import importlib
+
+
+_exports = {
+    'transform':['TransformCoordinates'],
+    'traffic':['TRAFFIC_URL','STATUS_CODES','get_traffic','decode_polylines','parse_traffic','grid_tasks',
+               'road_key','road_key_array','plan_requests','learn_road_levels','attribute_levels','dedupe_traffic'],
+    'grid':['GridSpec','GridAggregator','aggregate_file','gridding','standardize_bound','centroid_within',
+            'grid_corners','rasterize_lines','TRAFFIC_STATUS','traffic_grid','gridding_parallel','aggregate_parallel'],
+    'crawl':['get_current_time','strftime','TokenBucket','make_session','ResponseCache','RETRY_INFOCODES',
+             'KEY_INFOCODES','classify_error','RetryPolicy','KeyPool','TrafficCrawler','split_cell',
+             'SPLIT_INFOCODES','quadtree_crawl','CrawlScheduler'],
+    'metrics':['Histogram','CrawlMetrics'],
+    'storage':['TrafficWriter','iter_traffic','read_traffic','TrafficStore'],
+    'activity':['ACTIVITY_CODES','ACTIVITIES','encode_patterns','decode_patterns','encode','ActivityPatterns',
+                'rolling_grams','transition_counts','transition_frame','transition_matrices','NgramCounts',
+                'count_ngrams'],
+    'clustering':['transition_features','MarkovClustering'],
+    'plot':['listed_bins','classify','geoplot_listed_colormap'],
+}
+_names = {name:module for module,names in _exports.items() for name in names}
+__all__ = sorted(_names)
+
+
+def __getattr__(name):
+    if name in _names:
+        value = getattr(importlib.import_module('.' + _names[name],__name__),name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
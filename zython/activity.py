@@ -0,0 +1,425 @@
+"""
+*****************************************************************************************
+Activity patterns: daily sequences of activity codes per person, one column per time slot,
+and their Markov transition matrices by cluster.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+ACTIVITY_CODES = {'H':1,'W':2,'S':3,'E':4,'B':5,'D':6,'R':7,'O':8}
+ACTIVITIES = list(ACTIVITY_CODES)
+
+# lookup tables, ascii byte of the letter -> code and code -> letter, 0 / '' for anything else
+_CODE_LUT = np.zeros(256,dtype=np.uint8)
+_CODE_LUT[[ord(a) for a in ACTIVITY_CODES]] = list(ACTIVITY_CODES.values())
+_LETTER_LUT = np.array([''] * 256,dtype='<U1')
+_LETTER_LUT[list(ACTIVITY_CODES.values())] = ACTIVITIES
+
+
+def encode_patterns(letters):
+    """ activity letters -> uint8 codes of ACTIVITY_CODES by a lookup table, 0 for unknown letters, NaN and
+    strings that are not a single letter ('Hx', '')
+    """
+    letters = np.asarray(letters)
+    if letters.dtype.kind not in 'US':
+        letters = letters.astype(str)
+    # code point of the first character, looked up only for single characters of the table range, else 0
+    first = letters.astype(letters.dtype.kind + '1').view(np.uint32 if letters.dtype.kind == 'U' else np.uint8)
+    return _CODE_LUT[np.where((first < 256) & (np.char.str_len(letters) == 1),first,0)]
+
+
+def decode_patterns(codes):
+    """ codes -> activity letters by a lookup table, '' for 0 and unknown codes
+    """
+    return _LETTER_LUT[np.asarray(codes).astype(np.uint8)]
+
+
+def encode(data,to_='pat'):
+    """ activity pattern encode transforming between letter and number
+    Parameters
+    ----------
+    data: activity pattern, dataframe or array
+    to_:  'pat' or 'num'.
+          'pat' is to transform number to pattern
+          'num' is to transform pattern to number (uint8)
+    """
+    if to_ == 'num':
+        values = encode_patterns(data.values if hasattr(data,'values') else data)
+    elif to_ == 'pat':
+        values = decode_patterns(data.values if hasattr(data,'values') else data)
+    else:
+        raise ValueError("to_ should be 'pat' or 'num'.")
+    if hasattr(data,'columns'):
+        import pandas as pd
+        return pd.DataFrame(values,index=data.index,columns=data.columns)
+    return values
+
+
+class ActivityPatterns(object):
+    """ Activity patterns of many persons as a compact uint8 code matrix
+    Parameters
+    ----------
+    codes: (persons,slots) uint8 array of ACTIVITY_CODES, 0 unknown; may be a read only memmap, see load()
+    pids: person id of every row
+    slots: column names of the time slots
+    classid: cluster id of every row, None if not clustered
+
+    A national survey of 10 million persons with 24 slots takes 240 MB, against several GB for the
+    object dataframe of letters.
+    """
+    def __init__(self,codes,pids,slots,classid=None):
+        self.codes = codes
+        self.pids = np.asarray(pids)
+        self.slots = [str(c) for c in slots]
+        self.classid = None if classid is None else np.asarray(classid)
+
+    def __repr__(self):
+        return 'ActivityPatterns({} persons x {} slots{})'.format(self.codes.shape[0],self.codes.shape[1],
+                                                                  '' if self.classid is None else ', clustered')
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @classmethod
+    def read_csv(cls,path,index_col='PersonID',chunksize=100000,**kwargs):
+        """ Read a pattern csv (person id column, then one letter per slot) chunk by chunk
+        Slots are parsed as categoricals, so no string object is created per cell: each chunk is encoded to
+        uint8 through the codes of its few categories, and only one chunk is held at a time.
+        """
+        import pandas as pd
+        columns = pd.read_csv(path,nrows=0,**kwargs).columns
+        dtype = {c:'category' for c in columns if c != index_col}
+        codes,pids,slots = [],[],None
+        for chunk in pd.read_csv(path,index_col=index_col,chunksize=chunksize,dtype=dtype,**kwargs):
+            slots = chunk.columns if slots is None else slots
+            block = np.empty(chunk.shape,dtype=np.uint8)
+            for j,c in enumerate(chunk.columns):
+                cat = chunk[c].cat
+                # code of every category, and 0 at the end for the NaN code -1
+                lut = np.array([ACTIVITY_CODES.get(a,0) for a in cat.categories] + [0],dtype=np.uint8)
+                block[:,j] = lut[cat.codes.values]
+            codes.append(block)
+            pids.append(chunk.index.values)
+        if slots is None:
+            raise ValueError('{} has no rows.'.format(path))
+        return cls(np.concatenate(codes),np.concatenate(pids),slots)
+
+    def save(self,path):
+        """ Save to directory path: codes.npy, which load() can memory-map, and ids.npz
+        """
+        os.makedirs(path,exist_ok=True)
+        np.save(os.path.join(path,'codes.npy'),np.ascontiguousarray(self.codes,dtype=np.uint8))
+        ids = {'pids':self.pids,'slots':np.array(self.slots)}
+        if self.classid is not None:
+            ids['classid'] = self.classid
+        np.savez(os.path.join(path,'ids.npz'),**ids)
+
+    @classmethod
+    def load(cls,path,mmap_mode='r'):
+        """ Load a saved directory, codes are memory-mapped by default (mmap_mode=None reads them into memory)
+        """
+        codes = np.load(os.path.join(path,'codes.npy'),mmap_mode=mmap_mode)
+        with np.load(os.path.join(path,'ids.npz'),allow_pickle=True) as ids:
+            return cls(codes,ids['pids'],ids['slots'].tolist(),ids['classid'] if 'classid' in ids else None)
+
+    def letters(self):
+        """ (persons,slots) array of activity letters
+        """
+        return decode_patterns(self.codes)
+
+    def to_frame(self,letters=False):
+        """ DataFrame of codes (or letters) indexed by PersonID, or by (c, PersonID) sorted by cluster once
+        classid is set, as results() in matrix_colormap
+        """
+        import pandas as pd
+        values = self.letters() if letters else np.asarray(self.codes)
+        if self.classid is None:
+            return pd.DataFrame(values,index=pd.Index(self.pids,name='PersonID'),columns=self.slots)
+        order = np.argsort(self.classid,kind='stable')
+        index = pd.MultiIndex.from_arrays([self.classid[order],self.pids[order]],names=['c','PersonID'])
+        return pd.DataFrame(values[order],index=index,columns=self.slots)
+
+    def transition_matrices(self):
+        """ transition_matrices() of the clusters (of all persons when classid is None)
+        """
+        return transition_matrices(self.codes,self.classid)
+
+    def ngrams(self,order=1,by_slot=False,clusters=True,**kwargs):
+        """ count_ngrams() of the patterns, by cluster if clusters and classid is set
+        """
+        return count_ngrams(self.codes,self.classid if clusters else None,order=order,by_slot=by_slot,**kwargs)
+
+
+def transition_counts(num,clusters=None,k=8):
+    """ Transition counts of the activity patterns of every cluster, in a single bincount
+    Parameters
+    ----------
+    num: (persons,slots) array or dataframe of activity codes 1..k, encode(data,to_='num')
+         transitions from or to any other value (0, NaN) are not counted
+    clusters: cluster of every person, e.g. the classid column; None, all persons in one cluster
+    k: number of activities
+
+    Return
+    ------
+    labels: sorted cluster ids
+    counts: (len(labels),k,k) int64 array, counts[c,s-1,t-1] is the number of transitions s -> t in labels[c]
+    """
+    num = np.asarray(num)
+    if clusters is None:
+        labels,inv = np.zeros(1,dtype=np.int64),np.zeros(len(num),dtype=np.int64)
+    else:
+        labels,inv = np.unique(np.asarray(clusters),return_inverse=True)
+        inv = inv.ravel()
+    s,t = num[:,:-1],num[:,1:]
+    valid = (s >= 1) & (s <= k) & (t >= 1) & (t <= k)
+    rows = np.nonzero(valid)[0]
+    idx = (inv[rows] * k + s[valid].astype(np.int64) - 1) * k + t[valid].astype(np.int64) - 1
+    counts = np.bincount(idx,minlength=len(labels) * k * k).reshape(len(labels),k,k)
+    return labels,counts
+
+
+def transition_frame(counts,activities=ACTIVITIES):
+    """ DataFrame view of the (k,k) counts of one cluster, in percent of all its transitions
+    index s (from), columns t (to)
+    """
+    import pandas as pd
+    tm = pd.DataFrame(counts,index=pd.Index(activities,name='s'),columns=pd.Index(activities,name='t'))
+    #tm = tm.div(tm.sum(axis=1),axis=0).fillna(0).round(3)*100  # rate
+    tm = tm.div(tm.sum().sum()).round(3)*100
+    return tm
+
+
+def transition_matrices(num,clusters=None,activities=ACTIVITIES):
+    """ Transition matrices of all clusters at once
+    Parameters
+    ----------
+    num: (persons,slots) activity codes, see transition_counts
+    clusters: cluster of every person, None for one cluster
+    activities: activity letters of codes 1..k
+
+    Return
+    ------
+    counts: (n_clusters,k,k) int64 array of transition counts, in the order of the sorted cluster ids
+    tms: dict, cluster id -> transition_frame() of the cluster
+    """
+    labels,counts = transition_counts(num,clusters,k=len(activities))
+    tms = {label:transition_frame(c,activities) for label,c in zip(labels.tolist(),counts)}
+    return counts,tms
+
+
+def rolling_grams(num,order=1,k=8):
+    """ Rolling window encoding of the (persons,slots) codes num
+    Return
+    ------
+    gram: (persons,slots-order) int64, the codes - 1 of slots j..j+order as base k digits
+    valid: bool, whether all the codes of the window are within 1..k (not 0 or NaN)
+    """
+    num = np.asarray(num)
+    if num.dtype.kind == 'f':
+        num = np.nan_to_num(num).astype(np.int64)
+    persons,slots = num.shape
+    if slots <= order:
+        raise ValueError('Patterns of {} slots have no transition of order {}.'.format(slots,order))
+    windows = slots - order
+    gram = np.zeros((persons,windows),dtype=np.int64)
+    valid = np.ones((persons,windows),dtype=bool)
+    for i in range(order + 1):
+        a = num[:,i:i + windows]
+        valid &= (a >= 1) & (a <= k)
+        gram *= k
+        gram += a
+        gram -= 1
+    return gram,valid
+
+
+class NgramCounts(object):
+    """ Sparse counts of order-n transitions, (history of n activities) -> next activity, of activity patterns
+    Parameters
+    ----------
+    order: length of the history, 1 gives the counts of transition_counts, 2 and 3 second and third order chains
+    k: number of activities, codes 1..k
+    by_slot: count the transitions of every time slot apart (time of day tensors), the slot of a transition
+             is the column of its next activity
+
+    Only the observed n-grams are stored, as sorted unique int64 keys and their counts, so that the k**(n+1)
+    cells of a dense tensor are never allocated:
+        key = (cluster * nslot + slot) * k**(order+1) + gram,  gram = the n+1 codes - 1 as base k digits
+    Partial counts of chunks of persons, e.g. built in processes, are combined by merge().
+    """
+    def __init__(self,order=1,k=8,by_slot=False,nslot=None):
+        self.order = order
+        self.k = k
+        self.by_slot = by_slot
+        self.nslot = nslot
+        self.keys = np.zeros(0,dtype=np.int64)
+        self.counts = np.zeros(0,dtype=np.int64)
+
+    def __repr__(self):
+        return 'NgramCounts(order={}, k={}, by_slot={}, {} n-grams, {} transitions)'.format(
+            self.order,self.k,self.by_slot,len(self.keys),int(self.counts.sum()))
+
+    def encode(self,num,clusters=None):
+        """ keys of every valid transition of the (persons,slots) codes num, by a rolling window over the slots
+        Windows with a code outside 1..k (0, NaN) are dropped. clusters: non-negative integer ids, or None
+        """
+        num = np.asarray(num)
+        slots = num.shape[1]
+        n = self.order + 1
+        nslot = slots if self.by_slot else 1
+        if self.nslot is not None and self.nslot != nslot:
+            raise ValueError('Patterns of {} slots cannot be added to counts of {} slots.'.format(slots,self.nslot))
+        cmax = 0
+        if clusters is not None:
+            clusters = np.asarray(clusters).astype(np.int64)
+            if len(clusters) and clusters.min() < 0:
+                raise ValueError('Cluster ids should be non-negative integers.')
+            cmax = int(clusters.max()) if len(clusters) else 0
+        if (cmax + 1) * nslot * self.k ** n > np.iinfo(np.int64).max:
+            raise ValueError('order {} with {} slots exceeds the int64 key space.'.format(self.order,nslot))
+        
+        gram,valid = rolling_grams(num,self.order,self.k)
+        self.nslot = nslot
+        if self.by_slot:
+            gram += np.arange(self.order,slots,dtype=np.int64) * self.k ** n
+        if clusters is not None:
+            gram += (clusters * (nslot * self.k ** n))[:,None]
+        return gram[valid]
+
+    def update(self,num,clusters=None):
+        """ Count the transitions of a chunk of patterns
+        """
+        keys,counts = np.unique(self.encode(num,clusters),return_counts=True)
+        self._add(keys,counts.astype(np.int64))
+        return self
+
+    def merge(self,other):
+        """ Combine the partial counts of other patterns into these
+        """
+        if (other.order,other.k,other.by_slot) != (self.order,self.k,self.by_slot):
+            raise ValueError('Counts of different order, k or by_slot cannot be merged.')
+        if other.nslot is not None and self.nslot is not None and other.nslot != self.nslot:
+            raise ValueError('Counts of different slots cannot be merged.')
+        self.nslot = self.nslot if self.nslot is not None else other.nslot
+        self._add(other.keys,other.counts)
+        return self
+
+    def _add(self,keys,counts):
+        if len(self.keys):
+            keys = np.concatenate([self.keys,keys])
+            counts = np.concatenate([self.counts,counts])
+            order = np.argsort(keys,kind='mergesort')
+            keys,counts = keys[order],counts[order]
+            first = np.flatnonzero(np.concatenate([[True],keys[1:] != keys[:-1]]))
+            keys,counts = keys[first],np.add.reduceat(counts,first)
+        self.keys,self.counts = keys,counts
+
+    def decode(self):
+        """ Return
+        ------
+        cluster: cluster id of every n-gram (0 without clusters)
+        slot: slot of the next activity (0 without by_slot)
+        states: (m,order+1) uint8 codes, the history from the oldest activity, then the next activity
+        counts: number of transitions
+        """
+        n = self.order + 1
+        size = self.k ** n
+        rest,gram = np.divmod(self.keys,size)
+        cluster,slot = np.divmod(rest,self.nslot or 1)
+        states = np.empty((len(gram),n),dtype=np.uint8)
+        for i in range(n - 1,-1,-1):
+            gram,states[:,i] = np.divmod(gram,self.k)
+            states[:,i] += 1
+        return cluster,slot,states,self.counts
+
+    def probabilities(self):
+        """ P(next activity | cluster, slot, history) of every stored n-gram, aligned with keys
+        """
+        if len(self.keys) == 0:
+            return np.zeros(0)
+        prefix = self.keys // self.k
+        first = np.flatnonzero(np.concatenate([[True],prefix[1:] != prefix[:-1]]))
+        totals = np.add.reduceat(self.counts,first)
+        return self.counts / np.repeat(totals,np.diff(np.append(first,len(prefix))))
+
+    def to_frame(self,letters=True,activities=ACTIVITIES):
+        """ DataFrame of the n-grams: c, slot (with by_slot), s1..s{order} (history), t (next), count, prob
+        """
+        import pandas as pd
+        cluster,slot,states,counts = self.decode()
+        if letters:
+            states = np.array([''] + list(activities))[states]
+        df = pd.DataFrame({'c':cluster})
+        if self.by_slot:
+            df['slot'] = slot
+        for i in range(self.order):
+            df['s{}'.format(i + 1)] = states[:,i]
+        df['t'] = states[:,-1]
+        df['count'] = counts
+        df['prob'] = self.probabilities()
+        return df
+
+    def dense(self,cluster=0):
+        """ Dense count tensor of one cluster, shape (k,)*(order+1), with a leading slot axis for by_slot
+        Only for small orders, the tensor has nslot * k**(order+1) cells.
+        """
+        n = self.order + 1
+        size = (self.nslot or 1) * self.k ** n
+        i0,i1 = np.searchsorted(self.keys,[cluster * size,(cluster + 1) * size])
+        out = np.zeros(size,dtype=np.int64)
+        out[self.keys[i0:i1] - cluster * size] = self.counts[i0:i1]
+        return out.reshape(((self.nslot,) if self.by_slot else ()) + (self.k,) * n)
+
+    def save(self,path):
+        """ save the counts as .npz
+        """
+        np.savez(path,keys=self.keys,counts=self.counts,
+                 meta=np.array([self.order,self.k,int(self.by_slot),self.nslot or 0],dtype=np.int64))
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as f:
+            order,k,by_slot,nslot = f['meta'].tolist()
+            counts = cls(order,k,bool(by_slot),nslot or None)
+            counts.keys,counts.counts = f['keys'],f['counts']
+        return counts
+
+
+def _count_chunk(num,clusters,order,k,by_slot):
+    return NgramCounts(order,k,by_slot).update(num,clusters)
+
+
+def count_ngrams(num,clusters=None,order=1,k=8,by_slot=False,chunksize=200000,workers=1):
+    """ NgramCounts of a large pattern matrix, e.g. the memory-mapped codes of ActivityPatterns.load(), by chunks
+    Parameters
+    ----------
+    num: (persons,slots) activity codes
+    clusters: non-negative integer cluster id of every person, or None
+    order, k, by_slot: see NgramCounts
+    chunksize: persons per chunk, the rolling window of a chunk takes 8 * chunksize * slots bytes
+    workers: > 1, the chunks are counted in processes and the partial counts merged, at most
+             2 * workers chunks are in flight
+    """
+    res = NgramCounts(order,k,by_slot)
+    def chunk(i):
+        return np.asarray(num[i:i + chunksize]),None if clusters is None else np.asarray(clusters[i:i + chunksize])
+    
+    starts = range(0,len(num),chunksize)
+    if workers is None or workers <= 1:
+        for i in starts:
+            res.update(*chunk(i))
+        return res
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for i in starts:
+            pending.append(executor.submit(_count_chunk,*chunk(i),order,k,by_slot))
+            if len(pending) >= 2 * workers:
+                res.merge(pending.popleft().result())
+        while pending:
+            res.merge(pending.popleft().result())
+    return res
@@ -0,0 +1,165 @@
+"""
+*****************************************************************************************
+Command line entry point, python -m zython <command>, or zython <command> once installed (pip install .).
+
+    crawl   one crawl of a rectangle, e.g. every minute from cron:
+            python -m zython crawl --key KEY --bl 120.852620,30.677790 --ur 122.242919,31.874625 \
+                --levels 1 2 3 4 5 6 --out traffic --format json
+            with --format parquet --road-levels levels.json, the first crawl learns the road levels and
+            the next ones send a single request per grid
+    grid    write the grids of a rectangle (and boundary) to a file
+
+Only the modules a command needs are imported, and geopandas only when traffic is parsed into
+frames (--format parquet / gpkg, --store).
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import argparse
+import json
+import os
+
+
+def crawl(args):
+    """ Crawl the grids of a rectangle once, and write the responses or the parsed roads
+    """
+    from .crawl import KeyPool,ResponseCache,TrafficCrawler,get_current_time,strftime
+    from .grid import GridSpec
+    from .traffic import TRAFFIC_URL,plan_requests
+
+    road_levels = None
+    if args.road_levels and os.path.exists(args.road_levels):
+        with open(args.road_levels,encoding='utf-8') as f:
+            road_levels = json.load(f)
+    spec = GridSpec(args.bl,args.ur,args.size)
+    tasks = plan_requests(spec,args.levels,road_levels)
+    key = args.key[0] if len(args.key) == 1 else KeyPool(args.key,qps=args.qps)
+    cache = ResponseCache(args.cache) if args.cache else None
+    metrics = None
+    if args.metrics_file:
+        from .metrics import CrawlMetrics
+        metrics = CrawlMetrics()
+    crawler = TrafficCrawler(key,qps=args.qps,workers=args.workers,url=args.url or TRAFFIC_URL,cache=cache,run=args.run,
+                             metrics=metrics)
+
+    crawl_time = get_current_time()
+    stamp = crawl_time.strftime('%Y%m%d%H%M')
+    os.makedirs(args.out,exist_ok=True)
+    if args.format == 'json':
+        # raw responses, one json per line, nothing heavier than requests is imported
+        path = os.path.join(args.out,'traffic-{}.jsonl'.format(stamp))
+        writer = None
+        f = open(path,'a',encoding='utf-8')
+    else:
+        from .storage import TrafficWriter
+        from .traffic import parse_traffic
+        if args.format == 'parquet':
+            path = os.path.join(args.out,'traffic-{}'.format(stamp))
+        else:
+            path = os.path.join(args.out,'traffic-{}.gpkg'.format(stamp))
+        writer = TrafficWriter(path,fmt=args.format)
+
+    errors = 0
+    try:
+        for (i,blc,urc,level),data in crawler.run(tasks):
+            if data is None or data['status'] == '0':
+                errors += 1
+                continue
+            if writer is None:
+                f.write(json.dumps({'idx':i,'blc':blc,'urc':urc,'level':level,'time':strftime(crawl_time),'data':data},
+                                   ensure_ascii=False) + '\n')
+            else:
+                traffic = parse_traffic(data)
+                traffic['level'] = level
+                writer.write(traffic)
+    finally:
+        if writer is None:
+            f.close()
+        crawler.close()
+        if cache is not None:
+            cache.close()
+    crawler.report()
+    if metrics is not None:
+        metrics.observe_run(crawl_time,crawler.seconds)
+        metrics.write(args.metrics_file)
+
+    res = None
+    if args.road_levels and road_levels is None and writer is not None:
+        # crawled level by level: learn the levels, the next crawls send one request per grid
+        from .storage import read_traffic
+        from .traffic import learn_road_levels
+        res = read_traffic(path)
+        with open(args.road_levels,'w',encoding='utf-8') as f:
+            json.dump(learn_road_levels(res),f,ensure_ascii=False)
+        print('Road levels written to {}'.format(args.road_levels))
+    if args.store and writer is not None:
+        from .storage import TrafficStore,read_traffic
+        from .traffic import attribute_levels,dedupe_traffic
+        res = read_traffic(path) if res is None else res
+        if road_levels is not None:
+            res = attribute_levels(res,road_levels,args.levels)
+        TrafficStore(args.store).append(dedupe_traffic(res),crawl_time)
+    print('{}: {} tasks, {} errors, written to {}'.format(strftime(crawl_time),len(tasks),errors,path))
+    return 1 if errors and errors == len(tasks) else 0
+
+
+def grid(args):
+    """ Write gridding() of a rectangle to a file, the driver follows the extension (.geojson, .shp, .gpkg, .parquet)
+    """
+    from .grid import gridding
+
+    bound = None
+    if args.bound:
+        import geopandas as gpd
+        bound = gpd.read_file(args.bound).to_crs(4326).dissolve()
+    grids = gridding(args.bl,args.ur,args.size,bound=bound)
+    if args.out.endswith('.parquet'):
+        grids.to_parquet(args.out)
+    else:
+        grids.to_file(args.out)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m zython',description='Crawling and gridding of amap traffic.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('crawl',help='crawl the grids of a rectangle once')
+    p.add_argument('--key',action='append',required=True,help='amap api key, repeat for a key pool')
+    p.add_argument('--bl',required=True,help='bottom left location, "lon,lat" (wgs84)')
+    p.add_argument('--ur',required=True,help='upper right location, "lon,lat" (wgs84)')
+    p.add_argument('--size',type=float,default=7000,help='width of the square grids in metres (default 7000)')
+    p.add_argument('--levels',type=int,nargs='+',default=[1,2,3,4,5,6],help='road levels (default 1 to 6)')
+    p.add_argument('--road-levels',help='road key -> level json (needs --format parquet or gpkg): one request per grid '
+                   'at max(levels) when it exists, else one request per level and the file is learned after the crawl')
+    p.add_argument('--qps',type=float,default=50,help='QPS quota of each key (default 50)')
+    p.add_argument('--workers',type=int,default=10,help='concurrent requests (default 10)')
+    p.add_argument('--cache',help='sqlite response cache, needed by --run')
+    p.add_argument('--run',help='crawl id, an interrupted run is resumed (needs --cache)')
+    p.add_argument('--out',default='.',help='output directory (default .)')
+    p.add_argument('--format',choices=['json','parquet','gpkg'],default='json',
+                   help='json: raw responses (no geopandas), parquet / gpkg: parsed roads (default json)')
+    p.add_argument('--store',help='TrafficStore directory the deduplicated roads are appended to')
+    p.add_argument('--metrics-file',help='json file the crawl metrics are written to')
+    p.add_argument('--url',help='api url, point it to a local server for testing')
+    p.set_defaults(func=crawl)
+
+    p = commands.add_parser('grid',help='write the grids of a rectangle')
+    p.add_argument('--bl',required=True,help='bottom left location, "lon,lat"')
+    p.add_argument('--ur',required=True,help='upper right location, "lon,lat"')
+    p.add_argument('--size',type=float,required=True,help='width of the square grids in metres')
+    p.add_argument('--bound',help='boundary file, only grids whose centroid is within it are kept')
+    p.add_argument('--out',required=True,help='output file')
+    p.set_defaults(func=grid)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'crawl' and args.store and args.format == 'json':
+        parser.error('--store needs --format parquet or gpkg')
+    if args.command == 'crawl' and args.road_levels and args.format == 'json':
+        parser.error('--road-levels needs --format parquet or gpkg')
+    return args.func(args)
@@ -0,0 +1,242 @@
+"""
+*****************************************************************************************
+Markov chain based clustering of activity patterns: every cluster is a Markov chain (initial
+activity and transition probabilities), persons are assigned by a mixture model fitted by EM,
+full batch or mini-batch, optionally over several processes.
+Env: python 3.8 (multiprocessing.shared_memory)
+*****************************************************************************************
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .activity import rolling_grams
+from .shared import share,attach
+
+
+def transition_features(num,order=1,k=8,chunksize=100000):
+    """ Per person counts of its order-n transitions, one bincount per chunk of persons
+    Parameters
+    ----------
+    num: (persons,slots) activity codes 1..k, e.g. ActivityPatterns.codes
+    order: order of the transitions
+    k: number of activities
+
+    Return: (persons,k**(order+1)) uint8 array (uint16 with more than 256 slots), column g counts the
+            transitions whose codes - 1 written as base k digits are g, see rolling_grams
+    """
+    persons,slots = np.shape(num)
+    g = k ** (order + 1)
+    dtype = np.uint8 if slots <= 256 else np.uint16
+    features = np.zeros((persons,g),dtype=dtype)
+    for i0 in range(0,persons,chunksize):
+        gram,valid = rolling_grams(num[i0:i0 + chunksize],order,k)
+        rows = np.nonzero(valid)[0]
+        counts = np.bincount(rows * g + gram[valid],minlength=len(gram) * g)
+        features[i0:i0 + len(gram)] = counts.reshape(len(gram),g)
+    return features
+
+
+def _estep(features,first,log_w,log_pi,log_a):
+    """ E step of a chunk of persons
+    Return: resp (persons,n) posterior cluster probabilities, and the sufficient statistics: cluster sizes,
+            initial activity counts (n,k), transition counts (n,k**(order+1)), log-likelihood
+    """
+    x = features.astype(np.float64)
+    ll = x @ log_a.reshape(len(log_a),-1).T + log_w
+    ok = first > 0
+    ll[ok] += log_pi[:,first[ok] - 1].T
+    top = ll.max(axis=1,keepdims=True)
+    resp = np.exp(ll - top)
+    total = resp.sum(axis=1,keepdims=True)
+    resp /= total
+    loglik = float((top + np.log(total)).sum())
+    s_pi = np.stack([resp[first == j + 1].sum(axis=0) for j in range(log_pi.shape[1])],axis=1)
+    return resp,(resp.sum(axis=0),s_pi,resp.T @ x,loglik)
+
+
+_worker_features = None
+
+
+def _init_features(descs):
+    """ worker: attach the shared features and first activities for the life of the process
+    """
+    global _worker_features
+    _worker_features = [attach(d) for d in descs]
+
+
+def _estep_shared(params,i0,i1,labels=False):
+    """ worker: E step of persons i0:i1 of the shared features, the labels instead of the responsibilities
+    """
+    (_,features),(_,first) = _worker_features
+    resp,stats = _estep(features[i0:i1],first[i0:i1],*params)
+    return (resp.argmax(axis=1) if labels else None),stats
+
+
+class MarkovClustering(object):
+    """ Mixture of Markov chains clustering of activity patterns
+    Parameters
+    ----------
+    num: (persons,slots) activity codes 1..k (ActivityPatterns.codes, memory-mapped or not)
+    order: order of the chains, 1 for the transition matrices of transition_matrices()
+    k: number of activities
+    chunksize: persons per E step chunk
+
+    The per person transition counts (transition_features) are computed once and kept, so that fit() and
+    sweep() can be run for many numbers of clusters. They take k**(order+1) bytes per person, 64 for
+    first order chains.
+    """
+    def __init__(self,num,order=1,k=8,chunksize=100000):
+        self.order = order
+        self.k = k
+        self.chunksize = chunksize
+        self.features = transition_features(num,order,k,chunksize)
+        self.first = np.asarray(num[:,0]).astype(np.uint8)
+        self.first[self.first > k] = 0
+        self.models = {}
+
+    def __len__(self):
+        return len(self.features)
+
+    def _mstep(self,stats,alpha):
+        size,s_pi,s_a,_ = stats
+        n = len(size)
+        log_w = np.log((size + 1e-12) / (size.sum() + n * 1e-12))
+        pi = s_pi + alpha
+        log_pi = np.log(pi / pi.sum(axis=1,keepdims=True))
+        a = s_a.reshape(n,-1,self.k) + alpha
+        log_a = np.log(a / a.sum(axis=2,keepdims=True)).reshape(n,-1)
+        return log_w,log_pi,log_a
+
+    def _init(self,n,rng,alpha,sample=10000):
+        """ parameters of a random partition of a sample of persons
+        """
+        idx = np.sort(rng.choice(len(self),min(sample,len(self)),replace=False))
+        resp = np.eye(n)[rng.integers(0,n,len(idx))]
+        x = self.features[idx].astype(np.float64)
+        first = self.first[idx]
+        s_pi = np.stack([resp[first == j + 1].sum(axis=0) for j in range(self.k)],axis=1)
+        return self._mstep((resp.sum(axis=0),s_pi,resp.T @ x,0.0),alpha)
+
+    def _pass(self,params,executor=None,labels=False):
+        """ E step over all persons, chunk by chunk, summing the statistics
+        Return: labels (cluster index of every person) or None, statistics
+        """
+        chunks = [(i0,min(i0 + self.chunksize,len(self))) for i0 in range(0,len(self),self.chunksize)]
+        if executor is None:
+            results = []
+            for i0,i1 in chunks:
+                resp,stats = _estep(self.features[i0:i1],self.first[i0:i1],*params)
+                results.append((resp.argmax(axis=1) if labels else None,stats))
+        else:
+            results = [f.result() for f in [executor.submit(_estep_shared,params,i0,i1,labels) for i0,i1 in chunks]]
+        stats = [sum(s[j] for _,s in results) for j in range(4)]
+        return (np.concatenate([l for l,_ in results]) if labels else None),stats
+
+    def fit(self,n,max_iter=100,tol=1e-6,batch_size=None,n_init=1,alpha=0.01,random_state=0,workers=1):
+        """ Fit a mixture of n Markov chains by EM and assign every person to its most probable cluster
+        Parameters
+        ----------
+        n: number of clusters
+        max_iter: maximum EM iterations, or epochs over the persons with batch_size
+        tol: stop when the log-likelihood per person improves by less than tol
+        batch_size: None, full batch EM; else stepwise (mini-batch) EM on random batches of this size,
+                    the statistics are a running average with step (t + 2) ** -0.7
+        n_init: number of random starts, the one of highest log-likelihood is kept
+        alpha: additive smoothing of the initial and transition counts
+        random_state: seed
+        workers: > 1, the full batch E steps run in processes over the features in shared memory
+
+        Return: classid, 1..n for every person, 1 is the largest cluster. The model is kept in models[n].
+        """
+        rng = np.random.default_rng(random_state)
+        executor,shared = None,[]
+        if workers is not None and workers > 1:
+            shared = [share(self.features),share(self.first)]
+            executor = ProcessPoolExecutor(max_workers=workers,initializer=_init_features,
+                                           initargs=([d for _,d in shared],))
+        try:
+            best = None
+            for _ in range(n_init):
+                params = self._init(n,rng,alpha)
+                if batch_size is None:
+                    params,loglik,it = self._fit_batch(params,max_iter,tol,alpha,executor)
+                else:
+                    params,loglik,it = self._fit_minibatch(params,max_iter,tol,alpha,batch_size,rng)
+                if best is None or loglik > best[1]:
+                    best = (params,loglik,it)
+            params,_,it = best
+            labels,stats = self._pass(params,executor,labels=True)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            for shm,_ in shared:
+                shm.close()
+                shm.unlink()
+
+        # clusters ordered by size, classid 1 is the largest
+        sizes = np.bincount(labels,minlength=n)
+        order = np.argsort(-sizes,kind='stable')
+        rank = np.empty(n,dtype=np.int64)
+        rank[order] = np.arange(n)
+        log_w,log_pi,log_a = params
+        loglik = stats[3]
+        nparams = (n - 1) + n * (self.k - 1) + n * (log_a.shape[1] // self.k) * (self.k - 1)
+        self.models[n] = {'classid':rank[labels] + 1,
+                          'weights':np.exp(log_w[order]),
+                          'initial':np.exp(log_pi[order]),
+                          'transitions':np.exp(log_a[order]).reshape((n,) + (self.k,) * (self.order + 1)),
+                          'loglik':loglik,
+                          'bic':-2 * loglik + nparams * np.log(len(self)),
+                          'iterations':it}
+        return self.models[n]['classid']
+
+    def _fit_batch(self,params,max_iter,tol,alpha,executor):
+        previous = -np.inf
+        for it in range(1,max_iter + 1):
+            _,stats = self._pass(params,executor)
+            params = self._mstep(stats,alpha)
+            loglik = stats[3]
+            if (loglik - previous) / len(self) < tol:
+                break
+            previous = loglik
+        return params,loglik,it
+
+    def _fit_minibatch(self,params,max_iter,tol,alpha,batch_size,rng):
+        scale = len(self) / batch_size
+        stats,step,previous = None,0,-np.inf
+        for it in range(1,max_iter + 1):
+            loglik = 0.0
+            perm = rng.permutation(len(self))
+            for b0 in range(0,len(self),batch_size):
+                idx = np.sort(perm[b0:b0 + batch_size])
+                _,batch = _estep(self.features[idx],self.first[idx],*params)
+                loglik += batch[3]
+                batch = [s * scale for s in batch[:3]] + [batch[3]]
+                eta = (step + 2) ** -0.7
+                stats = batch if stats is None else [(1 - eta) * s + eta * b for s,b in zip(stats,batch)]
+                step += 1
+                params = self._mstep(stats,alpha)
+            if (loglik - previous) / len(self) < tol:
+                break
+            previous = loglik
+        return params,loglik,it
+
+    def sweep(self,ns,**kwargs):
+        """ fit() for every n of ns on the cached features
+        Return: dataframe of n, log-likelihood, BIC and iterations, the classid are in models
+        """
+        import pandas as pd
+        for n in ns:
+            self.fit(n,**kwargs)
+        return pd.DataFrame([{'n':n,'loglik':self.models[n]['loglik'],'bic':self.models[n]['bic'],
+                              'iterations':self.models[n]['iterations']} for n in ns])
+
+    def save_classid(self,n,path):
+        """ write the classid of the n clusters model like the class-{n}.txt files read by cluster():
+        a header line, then idx,classid with idx the row number of the person (from 1)
+        """
+        classid = self.models[n]['classid']
+        with open(path,'w',encoding='utf-8') as f:
+            f.write('idx,classid\n')
+            f.write(''.join('{},{}\n'.format(i,c) for i,c in enumerate(classid.tolist(),1)))
@@ -0,0 +1,653 @@
+"""
+*****************************************************************************************
+Concurrent, rate limited, cached and resumable crawling of the amap traffic api, with adaptive
+(quadtree) cells and a wall clock aligned scheduler for continuous crawls.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import datetime
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pytz
+import requests
+import shapely
+
+from .traffic import TRAFFIC_URL,get_traffic,parse_traffic,plan_requests,attribute_levels
+from .grid import gridding
+
+
+def get_current_time(timezone='Asia/Shanghai'):
+    tz = pytz.timezone(timezone)
+    dt = datetime.datetime.now(tz)
+    return dt
+
+def strftime(t): 
+    return datetime.datetime.strftime(t,'%Y-%m-%d %H:%M:%S')
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter, thread safe
+    Parameters
+    ----------
+    rate: tokens added per second, e.g. the QPS quota of an amap key
+    capacity: maximum burst, default equal to rate
+    """
+    def __init__(self,rate,capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate,1.0)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self,n=1):
+        """ take n tokens if available, Return: 0 if taken, else seconds until they are available
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+    def acquire(self,n=1):
+        """ block until n tokens are available
+        """
+        while True:
+            wait = self.try_acquire(n)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+def make_session(pool_size=10):
+    """ requests.Session with a keep-alive connection pool of pool_size
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=pool_size)
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    return session
+
+
+class ResponseCache(object):
+    """ Persistent SQLite cache of raw api responses, with a crawl manifest
+    Responses are keyed by (rectangle, level, key-less params, time bucket), so reruns within the same
+    bucket cost no quota. The manifest records which (idx,level) of a run are completed.
+    Parameters
+    ----------
+    path: sqlite file
+    bucket: minutes of a time bucket
+    """
+    def __init__(self,path,bucket=5):
+        self.path = path
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path,check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, rectangle TEXT, '
+                              'level INTEGER, bucket INTEGER, created REAL, body TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS manifest (run TEXT, idx TEXT, level INTEGER, '
+                              'rectangle TEXT, key TEXT, PRIMARY KEY (run, idx, level))')
+
+    def time_bucket(self,t=None):
+        t = time.time() if t is None else t
+        return int(t // (self.bucket * 60))
+
+    def make_key(self,blLoc,urLoc,level,bucket):
+        params = {'rectangle':'{};{}'.format(blLoc,urLoc),'level':int(level),'extensions':'all',
+                  'output':'json','bucket':bucket}
+        return hashlib.sha1(json.dumps(params,sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self,blLoc,urLoc,level,bucket=None):
+        """ cached response of the current (or given) time bucket, None if missing
+        """
+        bucket = self.time_bucket() if bucket is None else bucket
+        return self.load(self.make_key(blLoc,urLoc,level,bucket))
+
+    def put(self,blLoc,urLoc,level,data,bucket=None):
+        """ store a response, return its key
+        """
+        bucket = self.time_bucket() if bucket is None else bucket
+        key = self.make_key(blLoc,urLoc,level,bucket)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)',
+                              (key,'{};{}'.format(blLoc,urLoc),int(level),bucket,time.time(),
+                               json.dumps(data,ensure_ascii=False)))
+        return key
+
+    def load(self,key):
+        with self.lock:
+            row = self.conn.execute('SELECT body FROM responses WHERE key = ?',(key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def mark_done(self,run,task,key):
+        idx,blLoc,urLoc,level = task
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO manifest VALUES (?,?,?,?,?)',
+                              (run,str(idx),int(level),'{};{}'.format(blLoc,urLoc),key))
+
+    def done(self,run):
+        """ completed tasks of a run, {(str(idx),level): response key}
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT idx, level, key FROM manifest WHERE run = ?',(run,)).fetchall()
+        return {(idx,level):key for idx,level,key in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+# infocodes of amap errors, https://lbs.amap.com/api/webservice/guide/tools/info/
+# retryable: ACCESS_TOO_FREQUENT, QPS_HAS_EXCEEDED_THE_LIMIT, GATEWAY_TIMEOUT, SERVER_IS_BUSY,
+#            RESOURCE_UNAVAILABLE, CUQPS/CKQPS/CUQPS_HAS_EXCEEDED_THE_LIMIT, UNKNOWN_ERROR
+RETRY_INFOCODES = ['10004','10014','10015','10016','10017','10019','10020','10021','20003']
+# fatal for the key: INVALID_USER_KEY, SERVICE_NOT_AVAILABLE, DAILY_QUERY_OVER_LIMIT, USERKEY_PLAT_NOMATCH,
+#                    IP_QUERY_OVER_LIMIT, INSUFFICIENT_PRIVILEGES, USER_KEY_RECYCLED, USER_DAILY_QUERY_OVER_LIMIT
+KEY_INFOCODES = ['10001','10002','10003','10009','10010','10012','10013','10044']
+
+
+def classify_error(data=None,error=None):
+    """ Classify the outcome of a request
+    Parameters
+    ----------
+    data: json data of the response
+    error: exception raised by the request
+
+    Return: None if successful, 'retry' (retryable), 'key' (fatal for the key) or 'fatal' (fatal for the request)
+    """
+    if error is not None:
+        if isinstance(error,(requests.exceptions.Timeout,requests.exceptions.ConnectionError,ValueError)):
+            return 'retry'
+        return 'fatal'
+    if data.get('status') == '1':
+        return None
+    if data.get('infocode') in RETRY_INFOCODES:
+        return 'retry'
+    if data.get('infocode') in KEY_INFOCODES:
+        return 'key'
+    return 'fatal'
+
+
+class RetryPolicy(object):
+    """ Retry of get_traffic requests
+    Parameters
+    ----------
+    retries: retries of a retryable error, immediately in the worker with jittered exponential backoff
+    base: backoff of the first retry in seconds, doubled every retry
+    cap: maximum backoff in seconds
+    timeout: timeout of every request in seconds
+    sweeps: passes over the tasks still failing with a retryable error at the end of a run
+    """
+    def __init__(self,retries=3,base=0.5,cap=30,timeout=10,sweeps=1):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.timeout = timeout
+        self.sweeps = sweeps
+
+    def backoff(self,attempt):
+        """ full jitter backoff before retry attempt (0 for the first retry)
+        """
+        return random.uniform(0,min(self.cap,self.base * 2 ** attempt))
+
+
+class KeyPool(object):
+    """ Pool of amap keys used by TrafficCrawler in place of a single key
+    Parameters
+    ----------
+    keys: list of amap api keys
+    qps: QPS quota of every key, a number, or a list aligned with keys
+    strategy: 'round_robin', or 'least_loaded' (the key with the fewest requests today first)
+    timezone: timezone of the daily quota reset (midnight)
+
+    Every key has its own token bucket, a request goes to the first key in dispatch order with a token
+    available. Keys reporting an exhausted daily quota are retired until the next reset, keys reporting
+    other fatal errors (e.g. INVALID_USER_KEY) are retired for good.
+    """
+    # DAILY_QUERY_OVER_LIMIT, USER_DAILY_QUERY_OVER_LIMIT
+    QUOTA_INFOCODES = ['10003','10044']
+
+    def __init__(self,keys,qps=50,strategy='round_robin',timezone='Asia/Shanghai'):
+        if strategy not in ['round_robin','least_loaded']:
+            raise ValueError('strategy should be round_robin or least_loaded.')
+        self.keys = list(keys)
+        qps = list(qps) if isinstance(qps,(list,tuple)) else [qps] * len(self.keys)
+        self.buckets = {k:TokenBucket(q) for k,q in zip(self.keys,qps)}
+        self.strategy = strategy
+        self.timezone = timezone
+        self.lock = threading.Lock()
+        self.cursor = 0
+        self.day = strftime(get_current_time(timezone))[:10]
+        self.usage = {k:0 for k in self.keys}  # requests today
+        self.total = {k:0 for k in self.keys}
+        self.errors = {k:0 for k in self.keys}
+        self.retired = {}  # key -> unix time it is back, inf for good
+        self.last_error = None
+
+    def next_reset(self):
+        now = get_current_time(self.timezone)
+        midnight = now.replace(hour=0,minute=0,second=0,microsecond=0) + datetime.timedelta(days=1)
+        return midnight.timestamp()
+
+    def active(self):
+        """ keys not retired, retired keys whose quota is reset come back
+        """
+        with self.lock:
+            now = time.time()
+            for k in [k for k,t in self.retired.items() if t <= now]:
+                del self.retired[k]
+            day = strftime(get_current_time(self.timezone))[:10]
+            if day != self.day:
+                self.day = day
+                self.usage = {k:0 for k in self.keys}
+            return [k for k in self.keys if k not in self.retired]
+
+    def acquire(self):
+        """ block until a key has a token, Return: the key, None if all keys are retired
+        """
+        while True:
+            keys = self.active()
+            if not keys:
+                return None
+            with self.lock:
+                if self.strategy == 'round_robin':
+                    start = self.cursor % len(keys)
+                    keys = keys[start:] + keys[:start]
+                    self.cursor += 1
+                else:
+                    keys = sorted(keys,key=lambda k: self.usage[k])
+            waits = []
+            for k in keys:
+                wait = self.buckets[k].try_acquire()
+                if wait == 0:
+                    with self.lock:
+                        self.usage[k] += 1
+                        self.total[k] += 1
+                    return k
+                waits.append(wait)
+            time.sleep(min(waits))
+
+    def release(self,key,data=None,error=None):
+        """ report the outcome of a request of key, see classify_error for error
+        """
+        if error is None:
+            return
+        with self.lock:
+            self.errors[key] += 1
+            if error == 'key' and key not in self.retired:
+                self.last_error = data
+                if data.get('infocode') in self.QUOTA_INFOCODES:
+                    self.retired[key] = self.next_reset()
+                else:
+                    self.retired[key] = float('inf')
+                print('Key ...{} retired: {} {}'.format(key[-6:],data.get('infocode'),data.get('info')))
+
+    def stats(self):
+        """ per key usage, dataframe of requests today, total requests, errors and retired until
+        """
+        import pandas as pd
+        self.active()
+        with self.lock:
+            until = {k:(strftime(datetime.datetime.fromtimestamp(t,get_current_time(self.timezone).tzinfo))
+                        if t != float('inf') else 'never') for k,t in self.retired.items()}
+            return pd.DataFrame({'key':[k[-6:] for k in self.keys],
+                                 'today':[self.usage[k] for k in self.keys],
+                                 'total':[self.total[k] for k in self.keys],
+                                 'errors':[self.errors[k] for k in self.keys],
+                                 'retired_until':[until.get(k) for k in self.keys]})
+
+
+class TrafficCrawler(object):
+    """ Concurrent crawler built around get_traffic
+    Parameters
+    ----------
+    key: amap api key, or a KeyPool of several keys
+    qps: QPS quota of the key, enforced by a token bucket (ignored for a KeyPool, which has its own)
+    workers: maximum number of concurrent requests, also the size of the connection pool
+    url: api url, point it to a local server for testing
+    timeout: request timeout in seconds, default policy.timeout
+    cache: ResponseCache, responses of the current time bucket are served from it
+    run: crawl id recorded in the cache manifest, completed tasks of the run are skipped on restart
+    offline: serve the completed tasks of run from the cache without network, others get None
+    metrics: CrawlMetrics, records the latency, errors by infocode and quota usage of every request
+    policy: RetryPolicy. Retryable errors are retried with backoff and swept again at the end of a run;
+            after an error fatal for the key (bad key, daily quota) the key is retired from the pool and
+            the request goes to another key, without keys left no more requests are sent.
+    """
+    def __init__(self,key,qps=50,workers=10,url=TRAFFIC_URL,timeout=None,cache=None,run=None,offline=False,
+                 metrics=None,policy=None):
+        if (run is not None or offline) and cache is None:
+            raise ValueError('run and offline need a cache.')
+        self.pool = key if isinstance(key,KeyPool) else KeyPool([key],qps)
+        self.workers = workers
+        self.url = url
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.timeout = timeout if timeout is not None else self.policy.timeout
+        self.cache = cache
+        self.run_id = run
+        self.offline = offline
+        self.metrics = metrics
+        self.session = make_session(workers)
+        self.lock = threading.Lock()  # counters updated by the workers
+        self.requests = 0
+        self.hits = 0
+        self.errors = 0
+        self.retries = 0
+        self.tasks = 0
+        self.succeeded = 0
+        self.failed = []
+        self.seconds = 0.0
+
+    def fetch(self,blLoc,urLoc,level):
+        """ rate limited get_traffic over the shared session, with retries
+        """
+        return self._fetch(blLoc,urLoc,level)[0]
+
+    def _request(self,blLoc,urLoc,level):
+        """ one rate limited request, Return: data (None if raised), error class (see classify_error)
+        """
+        key = self.pool.acquire()
+        if key is None:
+            return self.pool.last_error,'key'
+        t0 = time.monotonic()
+        try:
+            data = get_traffic(key,blLoc,urLoc,level,session=self.session,url=self.url,timeout=self.timeout)
+        except Exception as e:
+            with self.lock:
+                self.requests += 1
+            if self.metrics is not None:
+                self.metrics.request(key,time.monotonic() - t0,type(e).__name__)
+            return None,classify_error(error=e)
+        with self.lock:
+            self.requests += 1
+        error = classify_error(data)
+        self.pool.release(key,data,error)
+        if self.metrics is not None:
+            self.metrics.request(key,time.monotonic() - t0,data.get('infocode') if error else None)
+        return data,error
+
+    def _fetch(self,blLoc,urLoc,level):
+        """ Return: data (None if the request raised), cache key (None without cache),
+                    served from cache or not, error class (see classify_error)
+        """
+        if self.cache is not None:
+            bucket = self.cache.time_bucket()
+            data = self.cache.get(blLoc,urLoc,level,bucket)
+            if data is not None:
+                return data,self.cache.make_key(blLoc,urLoc,level,bucket),True,None
+        attempt = 0
+        while True:
+            data,error = self._request(blLoc,urLoc,level)
+            if error == 'key' and self.pool.active():
+                continue  # the key is retired, another key takes the request
+            if error != 'retry' or attempt == self.policy.retries:
+                break
+            with self.lock:
+                self.retries += 1
+            time.sleep(self.policy.backoff(attempt))
+            attempt += 1
+        key = None
+        if self.cache is not None and error is None:
+            key = self.cache.put(blLoc,urLoc,level,data,bucket)
+        return data,key,False,error
+
+    def run(self,tasks,sweeps=None):
+        """ Crawl tasks concurrently
+        Parameters
+        ----------
+        tasks: iterable of (idx,blLoc,urLoc,level), see grid_tasks()
+        sweeps: passes over the tasks failing with a retryable error, default policy.sweeps
+
+        Return: generator of (task,data) in completion order, data is None if the request raised.
+                A task failing with a retryable error is yielded after the last sweep only.
+                With a run id, a task is marked completed in the manifest once the consumer has taken it,
+                and completed tasks are not yielded again when the run is restarted.
+        """
+        sweeps = self.policy.sweeps if sweeps is None else sweeps
+        done = self.cache.done(self.run_id) if self.run_id is not None else {}
+        if self.offline:
+            for task in tasks:
+                key = done.get((str(task[0]),int(task[3])))
+                yield task,(self.cache.load(key) if key is not None else None)
+            return
+        tasks = [task for task in tasks if (str(task[0]),int(task[3])) not in done]
+        self.tasks += len(tasks)
+        
+        t0 = time.monotonic()
+        try:
+            for sweep in range(sweeps + 1):
+                retry = []
+                for task,(data,key,hit,error) in self._run_pass(tasks):
+                    if error == 'retry' and sweep < sweeps:
+                        retry.append(task)
+                        continue
+                    if hit:
+                        self.hits += 1
+                    if error is None:
+                        self.succeeded += 1
+                    else:
+                        self.errors += 1
+                        self.failed.append(task)
+                    yield task,data
+                    if self.run_id is not None and key is not None:
+                        self.cache.mark_done(self.run_id,task,key)
+                if not retry:
+                    break
+                print('Sweep {}: retry {} failed tasks.'.format(sweep + 1,len(retry)))
+                tasks = retry
+        finally:
+            self.seconds += time.monotonic() - t0
+
+    def _run_pass(self,tasks):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._fetch,*task[1:]):task for task in tasks}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future],future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def throughput(self):
+        """ requests per second
+        """
+        return self.requests / self.seconds if self.seconds > 0 else 0.0
+
+    def coverage(self):
+        """ share of tasks crawled successfully
+        """
+        return self.succeeded / self.tasks if self.tasks else 1.0
+
+    def report(self):
+        print('{} requests ({} retries, {} failed tasks, {} cache hits) in {:.1f} seconds, {:.2f} requests per second.'.format(
+            self.requests,self.retries,self.errors,self.hits,self.seconds,self.throughput()))
+        print('Coverage: {:.2%} of {} tasks.'.format(self.coverage(),self.tasks))
+        if len(self.pool.keys) > 1:
+            print(self.pool.stats())
+
+    def close(self):
+        self.session.close()
+
+
+def split_cell(blLoc,urLoc):
+    """ Split a rectangle into four quadrants
+    Return: list of (blLoc,urLoc), ordered bottom left, bottom right, upper left, upper right
+    """
+    blLon,blLat = [float(x) for x in blLoc.split(',')]
+    urLon,urLat = [float(x) for x in urLoc.split(',')]
+    midLon,midLat = (blLon + urLon) / 2,(blLat + urLat) / 2
+    quads = [(blLon,blLat,midLon,midLat),(midLon,blLat,urLon,midLat),
+             (blLon,midLat,midLon,urLat),(midLon,midLat,urLon,urLat)]
+    return [(str(x0) + ',' + str(y0),str(x1) + ',' + str(y1)) for x0,y0,x1,y1 in quads]
+
+
+# infocodes worth splitting the rectangle for: 20000 INVALID_PARAMS (rectangle too large), 20003 UNKNOWN_ERROR
+SPLIT_INFOCODES = ['20000','20003']
+
+
+def quadtree_crawl(crawler,blLoc,urLoc,level,size=7000,max_depth=4,max_roads=None):
+    """ Adaptive gridding driven by the api responses
+    Start from the gridding(blLoc,urLoc,size) cells and split a cell into four only when its request errors
+    out with one of SPLIT_INFOCODES or returns at least max_roads roads (truncated), up to max_depth.
+    Dense areas get small cells and sparse areas keep the coarse ones.
+    Parameters
+    ----------
+    crawler: TrafficCrawler
+    blLoc: bottom left location, "lon,lat"
+    urLoc: upper right location, "lon,lat"
+    level: road level, see get_traffic
+    size: width of the coarse square
+    max_depth: maximum number of splits of a coarse cell
+    max_roads: number of roads regarded as a truncated response, None to split on errors only
+
+    Return
+    ------
+    leaves: geodataframe of leaf cells, columns qid (quadtree id, "coarse index-quadrant-quadrant..."),
+            depth, blc, urc, status (api status, None if the request raised), roads, geometry
+    res: geodataframe, merged results of all leaves
+    """
+    import pandas as pd
+    import geopandas as gpd
+    grids = gridding(blLoc,urLoc,size)
+    tasks = [(str(i),blc,urc,level) for i,blc,urc in zip(grids.index,grids['blc'],grids['urc'])]
+    leaves = []
+    res = []
+    depth = 0
+    while tasks:
+        children = []
+        for (qid,blc,urc,level),data in crawler.run(tasks):
+            status = data['status'] if data is not None else None
+            roads = len(data['trafficinfo']['roads']) if status == '1' else 0
+            truncated = max_roads is not None and roads >= max_roads
+            if depth < max_depth and ((status == '0' and data['infocode'] in SPLIT_INFOCODES) or truncated):
+                children += [(qid + '-' + str(k),b,u,level) for k,(b,u) in enumerate(split_cell(blc,urc))]
+                continue
+            leaves.append([qid,depth,blc,urc,status,roads])
+            if roads:
+                traffic = parse_traffic(data)
+                traffic['level'] = level
+                res.append(traffic)
+        tasks = children
+        depth += 1
+    
+    leaves = pd.DataFrame(leaves,columns=['qid','depth','blc','urc','status','roads'])
+    bl = np.array([c.split(',') for c in leaves['blc']],dtype=float).reshape(-1,2)
+    ur = np.array([c.split(',') for c in leaves['urc']],dtype=float).reshape(-1,2)
+    leaves = gpd.GeoDataFrame(leaves,geometry=shapely.box(bl[:,0],bl[:,1],ur[:,0],ur[:,1]))
+    print('{} leaf cells, {} splits.'.format(len(leaves),(len(leaves) - len(grids)) // 3))
+    cols = ['level','name','status','direction','speed','lcodes','geometry']
+    res = pd.concat(res,ignore_index=True) if res else gpd.GeoDataFrame(columns=cols)
+    return leaves,res
+
+
+class CrawlScheduler(object):
+    """ Long running crawl launched every interval minutes, aligned to wall clock boundaries
+    Levels are crawled in priority order (1 first). When the estimated duration of a run, from the request
+    durations of the previous runs, would overrun its slot, the least important low_priority levels are shed
+    (not crawled); a low_priority level still running at the end of the slot is stopped (truncated).
+    With road_levels every grid is crawled by one request at the highest remaining level: that request also
+    carries the high priority levels, so it is never stopped, and shed levels are only filtered out of its
+    results by attribute_levels.
+    Parameters
+    ----------
+    crawler: TrafficCrawler, preferably with metrics
+    grids: gridding() result
+    levels: road levels wanted
+    store: TrafficStore, every run is appended as a snapshot
+    interval: minutes between runs
+    road_levels: see plan_requests
+    low_priority: levels that may be shed
+    metrics: CrawlMetrics
+    metrics_file: JSON file rewritten after every run
+    """
+    def __init__(self,crawler,grids,levels,store,interval=5,road_levels=None,low_priority=(5,6),
+                 metrics=None,metrics_file=None):
+        self.crawler = crawler
+        self.grids = grids
+        self.levels = sorted(levels)
+        self.store = store
+        self.interval = interval * 60
+        self.road_levels = road_levels
+        self.low_priority = list(low_priority)
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self.durations = {}  # request level -> seconds of the last run
+
+    def estimate(self,levels):
+        """ seconds of the requests of levels, a request level never run is bounded by the duration of the
+        nearest higher request level (a request returns the roads of its level and above)
+        """
+        tasks = plan_requests(self.grids,levels,self.road_levels)
+        seconds = 0
+        for level in set(task[3] for task in tasks):
+            higher = [l for l in self.durations if l >= level]
+            seconds += self.durations[min(higher)] if higher else 0
+        return seconds
+
+    def run_once(self,start,deadline):
+        """ One crawl, start: slot time (datetime), deadline: unix time of the end of the slot
+        Return: results of the run, levels shed, levels truncated
+        """
+        import pandas as pd
+        import geopandas as gpd
+        t0 = time.time()
+        levels = list(self.levels)
+        shed,truncated = [],[]
+        while any(l in self.low_priority for l in levels) and time.time() + self.estimate(levels) > deadline:
+            shed.append(max(l for l in levels if l in self.low_priority))
+            levels.remove(shed[-1])
+        tasks = plan_requests(self.grids,levels,self.road_levels)
+        
+        res = []
+        for level in sorted(set(task[3] for task in tasks)):
+            # a single request per grid carries every level, it is not low priority
+            stoppable = self.road_levels is None and level in self.low_priority
+            if stoppable and time.time() > deadline:
+                shed.append(level)
+                continue
+            t1 = time.time()
+            for (i,blc,urc,level),data in self.crawler.run([task for task in tasks if task[3] == level]):
+                if data is not None and data['status'] == '1':
+                    traffic = parse_traffic(data)
+                    traffic['level'] = level
+                    res.append(traffic)
+                if stoppable and time.time() > deadline:
+                    truncated.append(level)
+                    break
+            self.durations[level] = time.time() - t1
+            if self.metrics is not None:
+                self.metrics.observe_level(level,time.time() - t1)
+        
+        res = pd.concat(res,ignore_index=True) if res else gpd.GeoDataFrame(columns=['level','name','status','direction','speed','lcodes','geometry'])
+        if len(res) and self.road_levels is not None:
+            res = attribute_levels(res,self.road_levels,levels)
+        if len(res):
+            self.store.append(res,start)
+        if self.metrics is not None:
+            self.metrics.observe_run(start,time.time() - t0,shed,truncated)
+            if self.metrics_file is not None:
+                self.metrics.write(self.metrics_file)
+        print('{}: {} roads in {:.1f} seconds{}{}.'.format(strftime(start),len(res),time.time() - t0,
+              ', shed levels {}'.format(shed) if shed else '',', truncated levels {}'.format(truncated) if truncated else ''))
+        return res,shed,truncated
+
+    def run(self,max_runs=None):
+        """ Run forever (or max_runs times), slots that are missed because a run overran are skipped
+        """
+        runs = 0
+        while max_runs is None or runs < max_runs:
+            now = time.time()
+            slot = (now // self.interval + 1) * self.interval
+            time.sleep(max(slot - now,0))
+            start = datetime.datetime.fromtimestamp(slot,get_current_time().tzinfo)
+            self.run_once(start,slot + self.interval)
+            runs += 1
@@ -0,0 +1,562 @@
+"""
+*****************************************************************************************
+Cut geographic data into fixed-size grids (square), locate and aggregate points and roads on them.
+Geometries are built with shapely, geopandas and pandas are imported when a frame is returned.
+Env: python 3.8 (multiprocessing.shared_memory)
+*****************************************************************************************
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from shapely.geometry import Polygon,MultiPolygon
+
+from .shared import share,attach
+
+
+class GridSpec(object):
+    """ Definition of the grids of gridding(blLoc,urLoc,size), maps coordinates to grids and back
+    Parameters
+    ----------
+    blLoc: bottom left location, "lon,lat"
+    urLoc: upper right location, "lon,lat"
+    size: width of square
+
+    A grid is identified by (xid, yid) or by the packed int64 id xid * numLat + yid, which is also the row
+    order of gridding() without bound. Points outside the extent get xid = yid = id = -1.
+    """
+    def __init__(self,blLoc,urLoc,size):
+        blLon,blLat = blLoc.split(',')
+        urLon,urLat = urLoc.split(',')
+        [blLon,blLat,urLon,urLat] = [float(x) for x in [blLon,blLat,urLon,urLat]]
+        self.blLon,self.blLat,self.urLon,self.urLat = blLon,blLat,urLon,urLat
+        self.size = size
+        
+        # transform grid size to delta lon and lat
+        self.deltaLon = size * 360 / (2 * math.pi * 6371004 * math.cos((blLat + urLat) * math.pi / 360))
+        self.deltaLat = size * 360 / (2 * math.pi * 6371004)
+        self.numLon = math.ceil((urLon - blLon) / self.deltaLon)
+        self.numLat = math.ceil((urLat - blLat) / self.deltaLat)
+
+    def __repr__(self):
+        return 'GridSpec({},{};{},{}, size={}, {} x {})'.format(self.blLon,self.blLat,self.urLon,self.urLat,
+                                                              self.size,self.numLon,self.numLat)
+
+    def gridid(self,lon,lat):
+        """ Return: xid, yid (int64 arrays, -1 outside), inside (bool array, within the extent)
+        """
+        lon = np.asarray(lon,dtype=float)
+        lat = np.asarray(lat,dtype=float)
+        inside = (lon >= self.blLon) & (lon <= self.urLon) & (lat >= self.blLat) & (lat <= self.urLat)
+        with np.errstate(invalid='ignore'):
+            xid = np.floor((lon - self.blLon) / self.deltaLon)
+            yid = np.floor((lat - self.blLat) / self.deltaLat)
+        # points on the upper or right edge belong to the last grid
+        xid = np.where(inside,np.clip(xid,0,self.numLon - 1),-1).astype(np.int64)
+        yid = np.where(inside,np.clip(yid,0,self.numLat - 1),-1).astype(np.int64)
+        return xid,yid,inside
+
+    def cellid(self,lon,lat):
+        """ packed int64 grid id of points, -1 outside the extent
+        """
+        xid,yid,inside = self.gridid(lon,lat)
+        return np.where(inside,xid * self.numLat + yid,-1)
+
+    def xy(self,cellid):
+        """ packed grid id -> xid, yid
+        """
+        cellid = np.asarray(cellid,dtype=np.int64)
+        return cellid // self.numLat,cellid % self.numLat
+
+    def bounds(self,cellid):
+        """ packed grid id -> (n,4) array of minx, miny, maxx, maxy
+        """
+        xid,yid = self.xy(cellid)
+        return np.stack([self.blLon + self.deltaLon * xid,
+                         self.blLat + self.deltaLat * yid,
+                         np.minimum(self.blLon + self.deltaLon * (xid + 1),self.urLon),
+                         np.minimum(self.blLat + self.deltaLat * (yid + 1),self.urLat)],axis=-1)
+
+    def centroid(self,cellid):
+        """ packed grid id -> lon, lat of grid centroids
+        """
+        b = self.bounds(cellid)
+        return (b[...,0] + b[...,2]) / 2,(b[...,1] + b[...,3]) / 2
+
+    def corners(self,cellid=None):
+        """ packed grid id -> blc, urc, lists of the "lon,lat" strings of grid_corners(), all grids by default
+        """
+        if cellid is None:
+            cellid = np.arange(self.numLon * self.numLat)
+        b = self.bounds(cellid).tolist()
+        return [str(x0) + ',' + str(y0) for x0,y0,_,_ in b],[str(x1) + ',' + str(y1) for _,_,x1,y1 in b]
+
+
+class GridAggregator(object):
+    """ Out-of-core per grid statistics of point streams
+    Parameters
+    ----------
+    spec: GridSpec
+    columns: value columns to aggregate
+
+    Points per grid (count) and, for every column, the sum, number of non-NaN values, min and max are
+    accumulated in dense arrays of shape (numLon, numLat). Partial aggregators of chunks or files are
+    combined with merge(), the result joins back onto gridding() by xid and yid (see to_frame()).
+    """
+    def __init__(self,spec,columns=()):
+        self.spec = spec
+        self.columns = list(columns)
+        shape = (spec.numLon,spec.numLat)
+        self.count = np.zeros(shape,dtype=np.int64)
+        self.outside = 0
+        self.sums = {c:np.zeros(shape) for c in self.columns}
+        self.counts = {c:np.zeros(shape,dtype=np.int64) for c in self.columns}
+        self.mins = {c:np.full(shape,np.inf) for c in self.columns}
+        self.maxs = {c:np.full(shape,-np.inf) for c in self.columns}
+
+    def update(self,lon,lat,values=None):
+        """ Add a chunk of points
+        Parameters
+        ----------
+        lon, lat: array-like
+        values: dataframe or dict holding the value columns, aligned with lon and lat
+        """
+        n = self.spec.numLon * self.spec.numLat
+        shape = self.count.shape
+        ids = self.spec.cellid(lon,lat)
+        inside = ids >= 0
+        self.outside += int((~inside).sum())
+        ids = ids[inside]
+        self.count += np.bincount(ids,minlength=n).reshape(shape)
+        for c in self.columns:
+            v = np.asarray(values[c],dtype=float)[inside]
+            valid = ~np.isnan(v)
+            idx,v = ids[valid],v[valid]
+            self.sums[c] += np.bincount(idx,weights=v,minlength=n).reshape(shape)
+            self.counts[c] += np.bincount(idx,minlength=n).reshape(shape)
+            np.minimum.at(self.mins[c].reshape(-1),idx,v)
+            np.maximum.at(self.maxs[c].reshape(-1),idx,v)
+        return self
+
+    def merge(self,other):
+        """ Combine another partial aggregator of the same grids and columns into this one
+        """
+        if other.count.shape != self.count.shape or other.columns != self.columns:
+            raise ValueError('Aggregators of different grids or columns cannot be merged.')
+        self.count += other.count
+        self.outside += other.outside
+        for c in self.columns:
+            self.sums[c] += other.sums[c]
+            self.counts[c] += other.counts[c]
+            np.minimum(self.mins[c],other.mins[c],out=self.mins[c])
+            np.maximum(self.maxs[c],other.maxs[c],out=self.maxs[c])
+        return self
+
+    def mean(self,column):
+        """ dense (numLon, numLat) array of means, NaN for grids without values
+        """
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(self.counts[column] > 0,self.sums[column] / self.counts[column],np.nan)
+
+    def to_frame(self,empty=False):
+        """ Statistics as a dataframe with xid and yid, e.g. grids.merge(agg.to_frame(),on=['xid','yid'],how='left')
+        empty: also return grids without points
+        """
+        import pandas as pd
+        xid,yid = np.meshgrid(np.arange(self.spec.numLon),np.arange(self.spec.numLat),indexing='ij')
+        keep = np.ones(self.count.shape,dtype=bool) if empty else self.count > 0
+        df = pd.DataFrame({'xid':xid[keep],'yid':yid[keep],'count':self.count[keep]})
+        for c in self.columns:
+            has = self.counts[c] > 0
+            df[c + '_sum'] = self.sums[c][keep]
+            df[c + '_mean'] = self.mean(c)[keep]
+            df[c + '_min'] = np.where(has,self.mins[c],np.nan)[keep]
+            df[c + '_max'] = np.where(has,self.maxs[c],np.nan)[keep]
+        return df
+
+    def save(self,path):
+        """ save the partial result as .npz
+        """
+        arrays = {'count':self.count,'outside':np.array(self.outside)}
+        for c in self.columns:
+            arrays.update({c + '__sum':self.sums[c],c + '__counts':self.counts[c],
+                           c + '__min':self.mins[c],c + '__max':self.maxs[c]})
+        np.savez(path,**arrays)
+
+    @classmethod
+    def load(cls,spec,path,columns=()):
+        agg = cls(spec,columns)
+        with np.load(path) as f:
+            agg.count = f['count']
+            agg.outside = int(f['outside'])
+            for c in agg.columns:
+                agg.sums[c],agg.counts[c] = f[c + '__sum'],f[c + '__counts']
+                agg.mins[c],agg.maxs[c] = f[c + '__min'],f[c + '__max']
+        return agg
+
+
+def aggregate_file(spec,path,lon='lon',lat='lat',columns=(),chunksize=1000000,**kwargs):
+    """ Aggregate a CSV or Parquet file of points chunk by chunk
+    Parameters
+    ----------
+    spec: GridSpec
+    path: .csv (read by pandas.read_csv, kwargs are passed on) or .parquet (read by pyarrow in batches)
+    lon, lat: coordinate columns
+    columns: value columns to aggregate
+    chunksize: rows per chunk
+
+    Return: GridAggregator
+    """
+    import pandas as pd
+    agg = GridAggregator(spec,columns)
+    usecols = [lon,lat] + [c for c in columns if c not in (lon,lat)]
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize,columns=usecols):
+            chunk = batch.to_pandas()
+            agg.update(chunk[lon].values,chunk[lat].values,chunk)
+    else:
+        for chunk in pd.read_csv(path,usecols=usecols,chunksize=chunksize,**kwargs):
+            agg.update(chunk[lon].values,chunk[lat].values,chunk)
+    return agg
+
+
+def gridding(blLoc,urLoc,size,bound=None,corners=True,method='contains'):
+    """ Segment area into grids
+    Parameters
+    ----------
+    blLoc: bottom left location, "lon,lat"
+    urLoc: upper right location, "lon,lat"
+    size: width of square
+    bound: if set, extract grids within polygon; if not, return all grids within rectangle
+           a (Multi)Polygon, or a geodataframe whose first geometry is used (it is not modified)
+    method: how grid centroids are tested against bound, see centroid_within()
+    corners: add the "lon,lat" string columns blc and urc, they can also be added later by grid_corners()
+    
+    Retures
+    -------
+    grids: geodataframe
+    """
+    import geopandas as gpd
+    spec = GridSpec(blLoc,urLoc,size)
+    blLon,blLat,urLon,urLat = spec.blLon,spec.blLat,spec.urLon,spec.urLat
+    deltaLon,deltaLat,numLon,numLat = spec.deltaLon,spec.deltaLat,spec.numLon,spec.numLat
+    
+    # ids of all grids at once, ordered by xid then yid
+    xid,yid = np.meshgrid(np.arange(numLon),np.arange(numLat),indexing='ij')
+    xid,yid = xid.ravel(),yid.ravel()
+    
+    # grids within polygon
+    if bound is not None:
+        bound = standardize_bound(bound)
+        cx = (blLon + deltaLon * np.arange(numLon) + np.minimum(blLon + deltaLon * np.arange(1,numLon + 1),urLon)) / 2
+        cy = (blLat + deltaLat * np.arange(numLat) + np.minimum(blLat + deltaLat * np.arange(1,numLat + 1),urLat)) / 2
+        within = centroid_within(bound,cx,cy,method=method).ravel()
+        xid,yid = xid[within],yid[within]
+    
+    # bounds of all grids at once
+    blLon_grid = blLon + deltaLon * xid
+    blLat_grid = blLat + deltaLat * yid
+    urLon_grid = np.minimum(blLon + deltaLon * (xid + 1), urLon)
+    urLat_grid = np.minimum(blLat + deltaLat * (yid + 1), urLat)
+    polys = shapely.box(blLon_grid,blLat_grid,urLon_grid,urLat_grid)
+    
+    grids = gpd.GeoDataFrame({'xid':xid,'yid':yid},geometry=polys)
+    grids.crs = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
+    if corners:
+        grids = grid_corners(grids)
+    print('The area is divided into {} grids, {} in rows and {} in columns'.format(len(grids),numLon,numLat))
+    return grids
+
+
+def standardize_bound(bound):
+    """ bound as a single shapely (Multi)Polygon, a geodataframe or geoseries gives its first geometry
+    """
+    import geopandas as gpd
+    if isinstance(bound,(gpd.GeoDataFrame,gpd.GeoSeries)):
+        bound = bound.geometry.iloc[0]
+    if not isinstance(bound,(Polygon,MultiPolygon)):
+        raise TypeError('Please check the type of bound.')
+    return bound
+
+
+def centroid_within(bound,cx,cy,method='contains',band=64):
+    """ Whether grid centroids are within bound, vectorized
+    Parameters
+    ----------
+    bound: (Multi)Polygon
+    cx: centroid lon of each grid column (xid)
+    cy: centroid lat of each grid row (yid)
+    method: 'contains', one prepared contains_xy test of all centroids, the default
+            'scanline', intersect bound, clipped to bands of rows, with the centre line of each row and look
+            up every centroid of the row in the crossing intervals; rows touching a vertex of bound, and
+            bands where GEOS fails on an invalid bound (e.g. self-intersecting), fall back to 'contains'
+    band: rows per clipped band of 'scanline'
+
+    Return: bool array of shape (len(cx),len(cy))
+    """
+    cx = np.asarray(cx,dtype=float)
+    cy = np.asarray(cy,dtype=float)
+    mask = np.zeros((len(cx),len(cy)),dtype=bool)
+    shapely.prepare(bound)
+    
+    # columns and rows outside the bounding box are outside
+    minx,miny,maxx,maxy = bound.bounds
+    cols = (cx > minx) & (cx < maxx)
+    rows = np.flatnonzero((cy > miny) & (cy < maxy))
+    xs = cx[cols]
+    if method == 'contains':
+        x,y = np.meshgrid(xs,cy[rows],indexing='ij')
+        mask[np.ix_(cols,rows)] = shapely.contains_xy(bound,x,y)
+        return mask
+    elif method != 'scanline':
+        raise ValueError("method should be 'contains' or 'scanline'.")
+    
+    on_vertex = np.isin(cy,shapely.get_coordinates(bound)[:,1])
+    eps = 1e-9 * max(abs(maxx - minx),1.0)
+    for b0 in range(0,len(rows),band):
+        js = rows[b0:b0 + band]
+        try:
+            # only the part of bound around the band is intersected with its rows
+            piece = shapely.clip_by_rect(bound,minx - 1,cy[js[0]] - eps,maxx + 1,cy[js[-1]] + eps)
+            for j in js:
+                if on_vertex[j]:
+                    mask[cols,j] = shapely.contains_xy(bound,xs,cy[j])
+                    continue
+                line = shapely.linestrings([[minx - 1,cy[j]],[maxx + 1,cy[j]]])
+                ends = np.sort(shapely.get_coordinates(shapely.intersection(piece,line))[:,0])
+                k = np.searchsorted(ends,xs)
+                inside = k % 2 == 1
+                # centroids on or very close to the boundary are tested exactly
+                near = np.zeros(len(xs),dtype=bool)
+                if len(ends):
+                    near = (np.abs(xs - ends[np.clip(k,0,len(ends) - 1)]) < eps) | (np.abs(xs - ends[np.clip(k - 1,0,len(ends) - 1)]) < eps)
+                if near.any():
+                    inside[near] = shapely.contains_xy(bound,xs[near],cy[j])
+                mask[cols,j] = inside
+        except shapely.errors.GEOSException:
+            x,y = np.meshgrid(xs,cy[js],indexing='ij')
+            mask[np.ix_(cols,js)] = shapely.contains_xy(bound,x,y)
+    return mask
+
+
+def grid_corners(grids):
+    """ Add blc and urc, the "lon,lat" strings of bottom left and upper right corners, from grid bounds
+    """
+    import pandas as pd
+    b = shapely.bounds(grids.geometry.values)
+    grids = grids.copy()
+    grids['blc'] = pd.Series(b[:,0],index=grids.index).astype(str) + ',' + pd.Series(b[:,1],index=grids.index).astype(str)
+    grids['urc'] = pd.Series(b[:,2],index=grids.index).astype(str) + ',' + pd.Series(b[:,3],index=grids.index).astype(str)
+    return grids[['xid','yid','blc','urc','geometry']]
+
+
+def rasterize_lines(spec,geometries,categories=None,ncat=1):
+    """ Length of lines in every grid cell, without spatial join
+    Every segment is walked through the cells it crosses (Amanatides–Woo traversal): the parameters where it
+    crosses the grid lines are generated for all segments at once, and the pieces between consecutive
+    crossings are accumulated into their cells with bincount.
+    Parameters
+    ----------
+    spec: GridSpec
+    geometries: array-like of (Multi)LineStrings, lon/lat
+    categories: int array aligned with geometries, in [0, ncat), e.g. traffic status codes
+    ncat: number of categories
+
+    Return: float array of shape (numLon, numLat, ncat), length in metres. Parts outside the extent are ignored.
+    """
+    geometries = np.asarray(geometries,dtype=object)
+    categories = np.zeros(len(geometries),dtype=np.int64) if categories is None else np.asarray(categories,dtype=np.int64)
+    n = spec.numLon * spec.numLat
+    # MultiLineStrings are split into their parts
+    parts,part_of = shapely.get_parts(geometries,return_index=True)
+    categories = categories[part_of]
+    coords,idx = shapely.get_coordinates(parts,return_index=True)
+    if len(coords) < 2:
+        return np.zeros((spec.numLon,spec.numLat,ncat))
+    
+    # segments in grid index space, a cell is a unit square of size x size metres
+    u = (coords[:,0] - spec.blLon) / spec.deltaLon
+    v = (coords[:,1] - spec.blLat) / spec.deltaLat
+    seg = np.flatnonzero(idx[1:] == idx[:-1])
+    u0,v0,u1,v1 = u[seg],v[seg],u[seg + 1],v[seg + 1]
+    cat = categories[idx[seg]]
+    du,dv = u1 - u0,v1 - v0
+    seg_len = np.hypot(du,dv) * spec.size
+    uMax,vMax = (spec.urLon - spec.blLon) / spec.deltaLon,(spec.urLat - spec.blLat) / spec.deltaLat
+    
+    # parameters t in (0, 1) where every segment crosses a grid line or the upper/right edge of the extent
+    def crossings(a0,a1,d,amax):
+        lo,hi = np.floor(np.minimum(a0,a1)),np.floor(np.maximum(a0,a1))
+        num = (hi - lo).astype(np.int64)
+        owner = np.repeat(np.arange(len(a0)),num)
+        k = lo[owner] + 1 + (np.arange(num.sum()) - np.repeat(np.cumsum(num) - num,num))
+        t = (k - a0[owner]) / d[owner]
+        edge = np.flatnonzero((np.minimum(a0,a1) < amax) & (np.maximum(a0,a1) > amax))
+        return np.concatenate([owner,edge]),np.concatenate([t,(amax - a0[edge]) / d[edge]])
+    ou,tu = crossings(u0,u1,du,uMax)
+    ov,tv = crossings(v0,v1,dv,vMax)
+    m = len(seg)
+    owner = np.concatenate([np.arange(m),np.arange(m),ou,ov])
+    t = np.concatenate([np.zeros(m),np.ones(m),tu,tv])
+    order = np.lexsort((t,owner))
+    owner,t = owner[order],t[order]
+    
+    # pieces between consecutive crossings of the same segment, located by their midpoints
+    same = owner[1:] == owner[:-1]
+    o = owner[:-1][same]
+    t0,t1 = t[:-1][same],t[1:][same]
+    tm = (t0 + t1) / 2
+    um,vm = u0[o] + du[o] * tm,v0[o] + dv[o] * tm
+    inside = (um >= 0) & (um < uMax) & (vm >= 0) & (vm < vMax)
+    xid = np.minimum(np.floor(um[inside]).astype(np.int64),spec.numLon - 1)
+    yid = np.minimum(np.floor(vm[inside]).astype(np.int64),spec.numLat - 1)
+    cell = (xid * spec.numLat + yid) * ncat + cat[o[inside]]
+    length = np.bincount(cell,weights=(t1 - t0)[inside] * seg_len[o[inside]],minlength=n * ncat)
+    return length.reshape(spec.numLon,spec.numLat,ncat)
+
+
+# status of parse_traffic, the code is the position
+TRAFFIC_STATUS = ['未知','畅通','缓行','拥堵','严重拥堵']
+
+
+def traffic_grid(spec,traffic):
+    """ Per grid congestion metrics of crawled traffic
+    Parameters
+    ----------
+    spec: GridSpec
+    traffic: crawl results with status and LineString geometry, lon/lat
+
+    Return: dataframe of grids crossed by roads, columns xid, yid, km (road length), km of every status,
+            congested_km (拥堵 + 严重拥堵) and status_mean (length weighted mean status code, 未知 excluded).
+            Join it onto gridding() by xid and yid.
+    """
+    import pandas as pd
+    codes = traffic['status'].map({s:i for i,s in enumerate(TRAFFIC_STATUS)}).fillna(0).astype(np.int64).values
+    km = rasterize_lines(spec,traffic.geometry.values,codes,len(TRAFFIC_STATUS)) / 1000
+    total = km.sum(axis=2)
+    xid,yid = np.nonzero(total > 0)
+    df = pd.DataFrame({'xid':xid,'yid':yid,'km':total[xid,yid]})
+    for i,status in enumerate(TRAFFIC_STATUS):
+        df['km_' + status] = km[xid,yid,i]
+    df['congested_km'] = df['km_拥堵'] + df['km_严重拥堵']
+    known = km[xid,yid,1:]
+    with np.errstate(invalid='ignore'):
+        df['status_mean'] = (known * np.arange(1,len(TRAFFIC_STATUS))).sum(axis=1) / known.sum(axis=1)
+    return df
+
+
+_worker_bound = None
+
+
+def _init_bound(wkb):
+    global _worker_bound
+    _worker_bound = shapely.from_wkb(wkb) if wkb is not None else None
+
+
+def _band_cells(spec,i0,i1,corners,method):
+    """ worker: grids of columns i0:i1 (xid), within the bound of the process if any, as plain arrays
+    Return: xid, yid, (n,4) bounds of the grids, and the blc / urc strings (None without corners)
+    """
+    xid,yid = np.meshgrid(np.arange(i0,i1),np.arange(spec.numLat),indexing='ij')
+    xid,yid = xid.ravel(),yid.ravel()
+    if _worker_bound is not None:
+        cx = spec.centroid(np.arange(i0,i1) * spec.numLat)[0]
+        cy = spec.centroid(np.arange(spec.numLat))[1]
+        within = centroid_within(_worker_bound,cx,cy,method=method).ravel()
+        xid,yid = xid[within],yid[within]
+    b = spec.bounds(xid * spec.numLat + yid)
+    blc = urc = None
+    if corners:
+        s = b.astype(str)
+        blc = np.char.add(np.char.add(s[:,0],','),s[:,1]).astype(object)
+        urc = np.char.add(np.char.add(s[:,2],','),s[:,3]).astype(object)
+    return xid,yid,b,blc,urc
+
+
+def _band_aggregate(spec,columns,descs,i0,i1,chunksize):
+    """ worker: GridAggregator of points i0:i1 of the shared lon, lat and value arrays, updated chunk by chunk
+    so that one aggregator per worker is sent back
+    """
+    shms,arrays = zip(*[attach(d) for d in descs])
+    try:
+        agg = GridAggregator(spec,columns)
+        for j0 in range(i0,i1,chunksize):
+            j1 = min(j0 + chunksize,i1)
+            agg.update(arrays[0][j0:j1],arrays[1][j0:j1],{c:a[j0:j1] for c,a in zip(columns,arrays[2:])})
+    finally:
+        # views must be released before the blocks are closed
+        arrays = None
+        for shm in shms:
+            shm.close()
+    return agg
+
+
+def gridding_parallel(blLoc,urLoc,size,bound=None,corners=True,method='contains',workers=None,bands=None):
+    """ gridding() split into bands of grid columns processed by a ProcessPoolExecutor
+    Parameters are the same as gridding(), plus
+    workers: number of processes, default os.cpu_count()
+    bands: number of column bands, default 4 bands per worker
+
+    Every band is built in a worker, with or without bound: the bound test, the grid bounds and the corner
+    strings. The bound is sent once to every process. Bands are ranges of xid, so the parent only concatenates
+    them in order and makes the boxes from the bounds (cheaper than decoding WKB sent back by the workers);
+    xid and yid are global, the result equals gridding().
+    """
+    import geopandas as gpd
+    spec = GridSpec(blLoc,urLoc,size)
+    wkb = shapely.to_wkb(standardize_bound(bound)) if bound is not None else None
+    workers = workers or os.cpu_count()
+    bands = max(min(bands or workers * 4,spec.numLon),1)
+    edges = np.linspace(0,spec.numLon,bands + 1).astype(int)
+    
+    with ProcessPoolExecutor(max_workers=workers,initializer=_init_bound,initargs=(wkb,)) as executor:
+        futures = [executor.submit(_band_cells,spec,i0,i1,corners,method) for i0,i1 in zip(edges[:-1],edges[1:])]
+        parts = [future.result() for future in futures]
+    
+    xid,yid,b,blc,urc = [np.concatenate(p) if corners or k < 3 else None for k,p in enumerate(zip(*parts))]
+    grids = gpd.GeoDataFrame({'xid':xid,'yid':yid},geometry=shapely.box(b[:,0],b[:,1],b[:,2],b[:,3]))
+    grids.crs = "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs"
+    if corners:
+        grids.insert(2,'blc',blc)
+        grids.insert(3,'urc',urc)
+    print('The area is divided into {} grids, {} in rows and {} in columns'.format(len(grids),spec.numLon,spec.numLat))
+    return grids
+
+
+def aggregate_parallel(spec,lon,lat,values=None,columns=(),workers=None,chunksize=1000000):
+    """ GridAggregator.update() of large in-memory arrays split over a ProcessPoolExecutor
+    Parameters
+    ----------
+    spec: GridSpec
+    lon, lat: array-like
+    values: dataframe or dict holding the value columns
+    columns: value columns to aggregate
+    workers: number of processes, default os.cpu_count()
+    chunksize: points per update() inside a worker, bounds the temporary arrays
+
+    The coordinates and values are passed through shared memory and every worker aggregates one range of
+    points, so only one dense aggregator per worker is sent back and merged.
+    Return: GridAggregator
+    """
+    workers = workers or os.cpu_count()
+    arrays = [np.asarray(lon,dtype=float),np.asarray(lat,dtype=float)] + [np.asarray(values[c],dtype=float) for c in columns]
+    n = len(arrays[0])
+    edges = np.linspace(0,n,max(min(workers,n),1) + 1).astype(int)
+    
+    shared = [share(a) for a in arrays]
+    descs = [d for _,d in shared]
+    agg = GridAggregator(spec,columns)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_band_aggregate,spec,list(columns),descs,i0,i1,chunksize)
+                       for i0,i1 in zip(edges[:-1],edges[1:])]
+            for future in futures:
+                agg.merge(future.result())
+    finally:
+        for shm,_ in shared:
+            shm.close()
+            shm.unlink()
+    return agg
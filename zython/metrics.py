@@ -0,0 +1,142 @@
+"""
+*****************************************************************************************
+Crawl metrics: latency histograms, errors by infocode and quota usage, exported as json or
+prometheus text.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+from .crawl import get_current_time,strftime
+
+
+class Histogram(object):
+    """ Cumulative histogram of latencies in seconds, prometheus style buckets
+    """
+    def __init__(self,buckets=(0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,600)):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self,value):
+        self.counts[int(np.searchsorted(self.buckets,value))] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {'buckets':self.buckets,'counts':self.counts,'count':self.count,'sum':self.sum}
+
+
+class CrawlMetrics(object):
+    """ Latency histograms per run, per level and per cell, error counts by amap infocode, quota usage per key
+    and day, and levels shed (not crawled) or truncated (stopped at the deadline) by the scheduler. Thread safe, exposed as a JSON file (write) or a local
+    http endpoint (serve).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.run = Histogram()
+        self.level = {}
+        self.cell = Histogram()
+        self.errors = {}
+        self.quota = {}
+        self.shed = {}
+        self.truncated = {}
+        self.runs = 0
+        self.last_run = None
+
+    def request(self,key,latency,error=None):
+        """ record a network request of key, error is the infocode or exception name of a failed request
+        """
+        day = strftime(get_current_time())[:10]
+        with self.lock:
+            self.cell.observe(latency)
+            quota = self.quota.setdefault(key[-6:] if key else '',{})
+            quota[day] = quota.get(day,0) + 1
+            if error is not None:
+                self.errors[str(error)] = self.errors.get(str(error),0) + 1
+
+    def observe_level(self,level,seconds):
+        with self.lock:
+            self.level.setdefault(str(level),Histogram()).observe(seconds)
+
+    def observe_run(self,start,seconds,shed=(),truncated=()):
+        with self.lock:
+            self.run.observe(seconds)
+            self.runs += 1
+            self.last_run = {'start':strftime(start),'seconds':seconds,'shed':list(shed),'truncated':list(truncated)}
+            for level in shed:
+                self.shed[str(level)] = self.shed.get(str(level),0) + 1
+            for level in truncated:
+                self.truncated[str(level)] = self.truncated.get(str(level),0) + 1
+
+    def to_dict(self):
+        with self.lock:
+            return {'runs':self.runs,'last_run':self.last_run,'run':self.run.to_dict(),
+                    'level':{k:h.to_dict() for k,h in self.level.items()},'cell':self.cell.to_dict(),
+                    'errors':dict(self.errors),'quota':{k:dict(v) for k,v in self.quota.items()},
+                    'shed':dict(self.shed),'truncated':dict(self.truncated)}
+
+    def prometheus(self):
+        """ metrics in prometheus text format
+        """
+        d = self.to_dict()
+        lines = []
+        def histogram(name,h,labels=''):
+            cum = np.cumsum(h['counts'])
+            for b,c in zip(h['buckets'] + ['+Inf'],cum):
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(name,labels,b,c))
+            tag = '{{{}}}'.format(labels.rstrip(',')) if labels else ''
+            lines.append('{}_sum{} {}'.format(name,tag,h['sum']))
+            lines.append('{}_count{} {}'.format(name,tag,h['count']))
+        histogram('traffic_run_seconds',d['run'])
+        for level,h in d['level'].items():
+            histogram('traffic_level_seconds',h,'level="{}",'.format(level))
+        histogram('traffic_cell_seconds',d['cell'])
+        for code,n in d['errors'].items():
+            lines.append('traffic_errors_total{{infocode="{}"}} {}'.format(code,n))
+        for key,days in d['quota'].items():
+            for day,n in days.items():
+                lines.append('traffic_requests_total{{key="{}",day="{}"}} {}'.format(key,day,n))
+        for level,n in d['shed'].items():
+            lines.append('traffic_shed_total{{level="{}"}} {}'.format(level,n))
+        for level,n in d['truncated'].items():
+            lines.append('traffic_truncated_total{{level="{}"}} {}'.format(level,n))
+        return '\n'.join(lines) + '\n'
+
+    def write(self,path):
+        """ write the metrics to a JSON file, replaced atomically
+        """
+        tmp = path + '.tmp'
+        with open(tmp,'w',encoding='utf-8') as f:
+            json.dump(self.to_dict(),f,ensure_ascii=False,indent=1)
+        os.replace(tmp,path)
+
+    def serve(self,port=9108,host='127.0.0.1'):
+        """ serve /metrics (prometheus text) and /metrics.json in a background thread, return the server
+        """
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics.json':
+                    body,ctype = json.dumps(metrics.to_dict(),ensure_ascii=False).encode('utf-8'),'application/json'
+                elif self.path == '/metrics':
+                    body,ctype = metrics.prometheus().encode('utf-8'),'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type',ctype)
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self,*args):
+                pass
+        server = ThreadingHTTPServer((host,port),Handler)
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+        return server
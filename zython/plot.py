@@ -0,0 +1,75 @@
+"""
+*****************************************************************************************
+Plotting helpers. matplotlib is imported by the functions themselves, so that importing zython
+never loads the plotting stack.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import numpy as np
+
+
+def listed_bins(values,bound):
+    """ bins [vmin] + bound + [vmax] of geoplot_listed_colormap, NaN ignored
+    The bins of one map can be passed to classify() or geoplot_listed_colormap(bins=) to draw other maps
+    with the same classes.
+    """
+    values = np.asarray(values,dtype=float)
+    return [float(np.nanmin(values))] + list(bound) + [float(np.nanmax(values))]
+
+
+def classify(values,bins):
+    """ Class of every value, vectorized by searchsorted
+    Class i holds the values in (bins[i], bins[i+1]], class 0 also bins[0].
+    Return: int64 array, -1 for NaN and for values outside [bins[0], bins[-1]]
+    """
+    values = np.asarray(values,dtype=float)
+    bins = np.asarray(bins,dtype=float)
+    if np.any(np.diff(bins) < 0):
+        raise ValueError('bins should be increasing.')
+    cls = np.searchsorted(bins,values,side='left') - 1
+    cls[values == bins[0]] = 0
+    cls[np.isnan(values) | (cls < 0) | (cls >= len(bins) - 1)] = -1
+    return cls
+
+
+def geoplot_listed_colormap(gdf,column,bound=None,ax=None,cmap='Reds',cmap_display=False,fig=None,bins=None,
+                            missing_kwds=None):
+    
+    """ improved geopandas.plot() function, plotting based on discrete listedcmap
+    Params:
+        gdf: geodataframe, it is not modified
+        column: same to gdf.plot(column) 
+        bound: list type, values between vmin and vmax
+        cmap: same to gdf.plot(cmap)
+        cmap_display: show the color bar. If cmap_display=True, fig must add the input.
+        bins: precomputed bins, e.g. listed_bins() of another map, used instead of bound
+        missing_kwds: same to gdf.plot(missing_kwds), style of NaN and values outside bins; None, they are not drawn
+    Return: classes of the rows, see classify()
+    """    
+    if bound is None and bins is None:
+        raise ValueError('bound or bins should be given.')
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+    from matplotlib.colors import ListedColormap
+    
+    # bounds
+    values = gdf[column].to_numpy(dtype=float,na_value=np.nan)
+    bounds = list(bins) if bins is not None else listed_bins(values,bound)
+    cls = classify(values,bounds)
+    
+    # colormap, the classes are normalized on all bins so that the colors do not depend on the classes present
+    c = plt.get_cmap(cmap, 256)
+    colors = c(np.linspace(0, 1, len(bounds)-1))
+    cmap = ListedColormap(colors)
+    gdf.plot(ax=ax,column=np.where(cls >= 0,cls,np.nan),cmap=cmap,vmin=0,vmax=max(len(bounds) - 2,1),
+             missing_kwds=missing_kwds)
+    
+    # colorbar
+    if cmap_display:
+        divider = make_axes_locatable(ax)
+        cax = divider.append_axes("right", size="5%", pad=0.1)
+        cbar = fig.colorbar(mappable=mpl.cm.ScalarMappable(cmap=cmap), cax=cax,ticks=np.linspace(0,1,len(bounds)))
+        cbar.ax.set_yticklabels(bounds)  # vertically oriented colorbar
+    return cls
@@ -0,0 +1,30 @@
+"""
+*****************************************************************************************
+Numpy arrays in shared memory, for the process pools of grid and clustering: the parent copies
+an array once with share(), the workers attach() it by the description instead of receiving a
+pickled copy with every task.
+Env: python 3.8 (multiprocessing.shared_memory)
+*****************************************************************************************
+"""
+
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def share(array):
+    """ copy an array into shared memory, return the block and its (name, shape, dtype) description
+    The caller closes and unlinks the block once the workers are done.
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True,size=max(array.nbytes,1))
+    np.ndarray(array.shape,dtype=array.dtype,buffer=shm.buf)[...] = array
+    return shm,(shm.name,array.shape,array.dtype.str)
+
+
+def attach(desc):
+    """ array view of a shared memory block described by share(), keep the returned block open while using it
+    and drop the view before closing it
+    """
+    name,shape,dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    return shm,np.ndarray(shape,dtype=dtype,buffer=shm.buf)
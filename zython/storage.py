@@ -0,0 +1,182 @@
+"""
+*****************************************************************************************
+Storage of crawled traffic: streamed GeoParquet / GeoPackage output and a time series store
+with interned road geometries.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from .traffic import STATUS_CODES,road_key_array
+
+
+class TrafficWriter(object):
+    """ Stream parse_traffic batches to disk instead of accumulating them in memory
+    Parameters
+    ----------
+    path: fmt='parquet', directory of GeoParquet partitions part-00000.parquet, part-00001.parquet, ...
+          fmt='gpkg', GeoPackage file, every batch is appended in one transaction
+    fmt: 'parquet' or 'gpkg'
+    layer: layer name of the GeoPackage
+    """
+    def __init__(self,path,fmt='parquet',layer='traffic'):
+        if fmt not in ['parquet','gpkg']:
+            raise ValueError('fmt should be parquet or gpkg.')
+        self.path = path
+        self.fmt = fmt
+        self.layer = layer
+        self.parts = 0
+        self.rows = 0
+        if fmt == 'parquet':
+            os.makedirs(path,exist_ok=True)
+            self.parts = len(glob.glob(os.path.join(path,'part-*.parquet')))
+
+    def write(self,traffic):
+        if len(traffic) == 0:
+            return
+        traffic = traffic.copy()
+        # lcodes is an empty list in amap json when missing
+        traffic['lcodes'] = traffic['lcodes'].map(lambda x: ','.join(x) if isinstance(x,list) else x)
+        if traffic.crs is None:
+            traffic = traffic.set_crs(epsg=4326)
+        if self.fmt == 'parquet':
+            traffic.to_parquet(os.path.join(self.path,'part-{:05d}.parquet'.format(self.parts)))
+        else:
+            mode = 'a' if self.parts or os.path.exists(self.path) else 'w'
+            traffic.to_file(self.path,layer=self.layer,driver='GPKG',mode=mode)
+        self.parts += 1
+        self.rows += len(traffic)
+
+
+def iter_traffic(path,layer='traffic',chunksize=100000):
+    """ Lazily read results written by TrafficWriter, one geodataframe per partition (GeoParquet)
+    or per chunksize rows (GeoPackage)
+    """
+    if os.path.isdir(path):
+        for f in sorted(glob.glob(os.path.join(path,'part-*.parquet'))):
+            yield gpd.read_parquet(f)
+    else:
+        start = 0
+        while True:
+            chunk = gpd.read_file(path,layer=layer,rows=slice(start,start + chunksize))
+            if len(chunk) == 0:
+                break
+            yield chunk
+            start += chunksize
+
+
+def read_traffic(path,layer='traffic'):
+    """ Read all results written by TrafficWriter, concatenated once
+    """
+    parts = list(iter_traffic(path,layer))
+    if not parts:
+        return gpd.GeoDataFrame(columns=['level','name','status','direction','speed','lcodes','geometry'])
+    return pd.concat(parts,ignore_index=True)
+
+
+class TrafficStore(object):
+    """ Time series store of traffic snapshots
+    Road geometries are interned once in roads.parquet, keyed by road_key_array: road_key (name, lcodes,
+    direction), plus a hash of the geometry rounded to `precision` decimals for the roads without lcodes.
+    Every snapshot is a small columnar file snapshots/snapshot-<unix time>.parquet of
+    (road_id int32, timestamp int64 unix seconds, status_code int8, speed float32, NaN if unknown).
+    Naive times (strings or datetimes without tzinfo) given to append and query are local times of timezone,
+    the timezone of the crawl times printed by the crawler (get_current_time); aware times are used as is.
+    Parameters
+    ----------
+    path: directory of the store
+    precision: decimals of the coordinates hashed into the key of the roads without lcodes
+    timezone: timezone of naive times
+    """
+    def __init__(self,path,precision=5,timezone='Asia/Shanghai'):
+        self.path = path
+        self.precision = precision
+        self.timezone = timezone
+        self.snapshot_dir = os.path.join(path,'snapshots')
+        os.makedirs(self.snapshot_dir,exist_ok=True)
+        self.roads_file = os.path.join(path,'roads.parquet')
+        if os.path.exists(self.roads_file):
+            self.roads = gpd.read_parquet(self.roads_file)
+        else:
+            self.roads = gpd.GeoDataFrame({'road_id':np.array([],dtype=np.int32),'key':[],'name':[],
+                                           'direction':[],'lcodes':[]},geometry=[],crs='EPSG:4326')
+        self.ids = dict(zip(self.roads['key'],self.roads['road_id']))
+
+    def unix_time(self,t):
+        """ unix seconds of a datetime or string, naive times are localized to timezone
+        """
+        t = pd.Timestamp(t)
+        if t.tzinfo is None:
+            t = t.tz_localize(self.timezone)
+        return t.timestamp()
+
+    def intern(self,traffic):
+        """ road_id of every road of traffic, new roads are added to roads.parquet
+        """
+        keys = road_key_array(traffic,self.precision)
+        new = [k not in self.ids for k in keys]
+        if any(new):
+            add = traffic.loc[new,['name','direction','lcodes','geometry']].copy()
+            add.insert(0,'key',np.array(keys,dtype=object)[new])
+            add = add.drop_duplicates('key')
+            add.insert(0,'road_id',np.arange(len(self.ids),len(self.ids) + len(add),dtype=np.int32))
+            add['lcodes'] = add['lcodes'].map(lambda x: ','.join(x) if isinstance(x,list) else x)
+            add = add.set_crs(epsg=4326) if add.crs is None else add
+            self.ids.update(zip(add['key'],add['road_id']))
+            self.roads = pd.concat([self.roads,add],ignore_index=True)
+            self.roads.to_parquet(self.roads_file)
+        return np.array([self.ids[k] for k in keys],dtype=np.int32)
+
+    def append(self,traffic,timestamp):
+        """ Store a snapshot
+        Parameters
+        ----------
+        traffic: parse_traffic results of one crawl
+        timestamp: crawl time, datetime or string, local time of timezone if naive
+        """
+        ts = int(self.unix_time(timestamp))
+        status_codes = {v:int(k) for k,v in STATUS_CODES.items()}
+        snapshot = pd.DataFrame({'road_id':self.intern(traffic),
+                                 'timestamp':np.full(len(traffic),ts,dtype=np.int64),
+                                 'status_code':traffic['status'].map(status_codes).fillna(0).astype(np.int8).values,
+                                 'speed':pd.to_numeric(traffic['speed'],errors='coerce').astype(np.float32).values})
+        # a road returned identically by several grids is kept once, differing observations are all kept
+        snapshot = snapshot.drop_duplicates().sort_values('road_id',kind='stable')
+        snapshot.to_parquet(os.path.join(self.snapshot_dir,'snapshot-{:012d}.parquet'.format(ts)),index=False)
+        return len(snapshot)
+
+    def timestamps(self):
+        """ unix times of all snapshots
+        """
+        files = sorted(glob.glob(os.path.join(self.snapshot_dir,'snapshot-*.parquet')))
+        return [int(os.path.basename(f)[9:21]) for f in files]
+
+    def query(self,start=None,end=None,road_ids=None,geometry=False):
+        """ Snapshots with start <= time <= end, optionally of some roads only
+        Parameters
+        ----------
+        start, end: datetime or string (local time of timezone if naive), None for unbounded
+        road_ids: road ids to keep, see roads
+        geometry: join name, direction, lcodes and geometry of the roads
+
+        Return: dataframe (geodataframe if geometry) of road_id, timestamp, status_code, speed
+        """
+        start = -np.inf if start is None else self.unix_time(start)
+        end = np.inf if end is None else self.unix_time(end)
+        files = [os.path.join(self.snapshot_dir,'snapshot-{:012d}.parquet'.format(t))
+                 for t in self.timestamps() if start <= t <= end]
+        filters = [('road_id','in',list(road_ids))] if road_ids is not None else None
+        parts = [pd.read_parquet(f,filters=filters) for f in files]
+        if parts:
+            res = pd.concat(parts,ignore_index=True)
+        else:
+            res = pd.DataFrame({'road_id':np.array([],dtype=np.int32),'timestamp':np.array([],dtype=np.int64),
+                                'status_code':np.array([],dtype=np.int8),'speed':np.array([],dtype=np.float32)})
+        if geometry:
+            res = self.roads.drop(columns='key').merge(res,on='road_id')
+        return res
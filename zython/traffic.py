@@ -0,0 +1,253 @@
+"""
+*****************************************************************************************
+amap traffic status api: request, parse, request planning by road level and deduplication of roads.
+Only numpy, shapely and requests are imported here, pandas and geopandas when a result is built.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import hashlib
+import json
+import numpy as np
+import requests
+import shapely
+
+from .transform import TransformCoordinates
+from .grid import GridSpec
+
+
+TRAFFIC_URL = 'https://restapi.amap.com/v3/traffic/status/rectangle'
+
+
+def get_traffic(key,blLoc,urLoc,level=5,session=None,url=TRAFFIC_URL,timeout=None):
+    """ Get traffic data from amap API
+    Parameters
+    ----------
+    key: amap api key
+    blLoc: bottom left location, "lon,lat", wgs84
+    urLoc: upper right location, "lon,lat", wgs84
+    level: 1 - 高速（京藏高速）
+           2 - 城市快速路、国道(西三环、103国道)
+           3 - 高速辅路（G6辅路）
+           4 - 主要道路（长安街、三环辅路路）
+           5 - 一般道路（彩和坊路）
+           6 - 无名道路
+    session: requests.Session to reuse connections, default a new connection per request
+    url: api url, point it to a local server for testing
+    timeout: request timeout in seconds
+
+    Return: Json data
+    """
+    # transform coordinates, from wgs84 to gcj02
+    tc = TransformCoordinates()
+    blLon,blLat = tc.coordinates(blLoc,tctype='_gcj02')
+    urLon,urLat = tc.coordinates(urLoc,tctype='_gcj02')
+    blLoc = str(blLon) + ',' + str(blLat)
+    urLoc = str(urLon) + ',' + str(urLat)
+    
+    params = {'key':key,
+              'level':level,
+              'extensions': 'all',
+              'output':'json',
+              'rectangle':'{};{}'.format(blLoc,urLoc)
+             }
+    requester = session if session is not None else requests
+    response = requester.get(url,params=params,timeout=timeout)
+#     print(response.request.url)
+    data = json.loads(response.text)
+    return data
+
+
+STATUS_CODES = {'0':'未知','1':'畅通','2':'缓行','3':'拥堵','4':'严重拥堵'}
+
+
+def decode_polylines(polylines):
+    """ Decode amap polylines "lng,lat;lng,lat;..." into one flat array
+    Return
+    ------
+    coords: (n,2) float array of all vertices
+    offsets: int array of len(polylines) + 1, vertices of polyline k are coords[offsets[k]:offsets[k+1]]
+    """
+    npoints = np.fromiter((p.count(';') + 1 for p in polylines),dtype=np.int64,count=len(polylines))
+    offsets = np.zeros(len(polylines) + 1,dtype=np.int64)
+    np.cumsum(npoints,out=offsets[1:])
+    if len(polylines) == 0:
+        return np.empty((0,2)),offsets
+    coords = np.array(';'.join(polylines).replace(';',',').split(','),dtype=float).reshape(-1,2)
+    return coords,offsets
+
+
+def parse_traffic(data,tctype='_wgs84',tol=1e-9,max_iter=20):
+    """parse json data and get infomation
+    All polylines of the response are decoded and transformed in bulk, geometries are built by shapely.linestrings.
+    tctype: '_wgs84' (one-step approximation) or '_wgs84_exact' (iterative inverse)
+    tol, max_iter: convergence of the iterative inverse, see TransformCoordinates.gcj02_wgs84_exact
+    """
+    import geopandas as gpd
+    roads = data['trafficinfo']['roads']
+    coords,offsets = decode_polylines([item['polyline'] for item in roads])
+    lng,lat = TransformCoordinates().transform(coords[:,0],coords[:,1],tctype=tctype,tol=tol,max_iter=max_iter)
+    indices = np.repeat(np.arange(len(roads)),np.diff(offsets))
+    geometry = shapely.linestrings(np.column_stack([lng,lat]),indices=indices) if roads else []
+    
+    traffic = gpd.GeoDataFrame({
+        'name':[item['name'] for item in roads],                      # 道路名称
+        'status':[STATUS_CODES[item['status']] for item in roads],
+        'direction':[item['direction'] for item in roads],            # 以正东方向为0度，逆时针方向为正，取值范围：[0,360]
+        'speed':[item.get('speed','') for item in roads],             # 单位：千米/小时
+        'lcodes':[item['lcodes'] for item in roads]},
+        geometry=geometry)
+    return traffic
+
+
+def grid_tasks(grids,levels):
+    """ (idx,blc,urc,level) tasks of every grid at every level
+    grids: gridding() result, or a GridSpec to plan all grids of the rectangle without building geometries,
+           idx is then the packed grid id, which is also the index of gridding() without bound
+    """
+    if isinstance(grids,GridSpec):
+        idx = range(grids.numLon * grids.numLat)
+        blc,urc = grids.corners()
+    else:
+        idx,blc,urc = grids.index,grids['blc'],grids['urc']
+    return [(i,b,u,level) for level in levels for i,b,u in zip(idx,blc,urc)]
+
+
+def road_key(name,lcodes,direction):
+    """ identity of a road segment, lcodes is a string or an empty list in amap json
+    """
+    if isinstance(lcodes,list):
+        lcodes = ','.join(lcodes)
+    return '{}|{}|{}'.format(name,lcodes,direction)
+
+
+def road_key_array(res,precision=5):
+    """ road_key of every road of res, with a hash of its geometry rounded to precision decimals appended when
+    lcodes is empty: many segments have no lcodes, and their name and direction alone (often both empty or
+    shared by a ramp and a minor road) do not tell them apart
+    Return: list of keys aligned with res
+    """
+    keys = np.array([road_key(*r) for r in zip(res['name'],res['lcodes'],res['direction'])],dtype=object)
+    empty = np.array([not (isinstance(x,(str,list)) and x) for x in res['lcodes']],dtype=bool)
+    if empty.any():
+        geoms = shapely.set_precision(np.asarray(res.geometry.values)[empty],10.0 ** -precision)
+        digests = [hashlib.md5(w).hexdigest()[:16] for w in shapely.to_wkb(geoms,output_dimension=2)]
+        keys[empty] = [k + '|' + d for k,d in zip(keys[empty],digests)]
+    return keys.tolist()
+
+
+def plan_requests(grids,levels,road_levels=None):
+    """ Plan the minimal set of (idx,blc,urc,level) requests
+    amap `level` returns all roads at or above that level, so a single request at max(levels) per grid
+    covers every level. The response does not carry the road class, therefore the level of each road is
+    looked up in road_levels (see learn_road_levels and attribute_levels).
+    Parameters
+    ----------
+    grids: gridding() result or GridSpec, see grid_tasks
+    levels: road levels wanted
+    road_levels: dict, road_key_array key -> level. If None, one request per level is planned so that the
+                 levels can be learned from the results.
+    """
+    if road_levels is None:
+        return grid_tasks(grids,sorted(levels))
+    return grid_tasks(grids,[max(levels)])
+
+
+def learn_road_levels(res,precision=5):
+    """ key -> level from results crawled level by level, a road belongs to the lowest level returning it
+    Keys are road_key_array(res,precision), the same grids must be crawled to attribute the levels.
+    """
+    import pandas as pd
+    keys = road_key_array(res,precision)
+    return pd.Series(res['level'].values,index=keys).groupby(level=0).min().astype(int).to_dict()
+
+
+def attribute_levels(res,road_levels,levels=None,precision=5):
+    """ Attribute every road to its level from road_levels instead of the level of the request
+    Roads unknown to road_levels keep the level of the request (the least important level they can have).
+    Copies of a road returned by several levels of the same rectangle are dropped.
+    Parameters
+    ----------
+    res: crawl results with a 'level' column of the request
+    road_levels: dict, road_key_array key -> level, see learn_road_levels
+    levels: if set, keep roads of these levels only
+    precision: of road_key_array, as in learn_road_levels
+    """
+    import pandas as pd
+    keys = pd.Series(road_key_array(res,precision),index=res.index)
+    res = res.copy()
+    res['level'] = keys.map(road_levels).fillna(res['level']).astype(int)
+    dup = pd.DataFrame({'key':keys,'geometry':res.geometry.to_wkb()}).duplicated()
+    res = res[~dup.values]
+    if levels is not None:
+        res = res[res['level'].isin(levels)]
+    return res.reset_index(drop=True)
+
+
+def dedupe_traffic(res,precision=6,tolerance=1e-5):
+    """ Remove the copies of roads returned by adjacent grids
+    1. exact duplicates: same road_key and same coordinate sequence rounded to precision decimals
+    2. partial pieces: pairs of the remaining roads with the same road_key within tolerance of each other
+       are found by an STRtree query. The shared length of a pair is the length of each piece within
+       tolerance of the other. A piece lying on another road over its whole length is dropped; pieces
+       sharing more than 2 * tolerance are merged by line_merge and keep the attributes of the longest piece.
+    Parameters
+    ----------
+    res: crawl results
+    precision: decimals of the coordinates compared for exact duplicates
+    tolerance: distance in degrees, 1e-5 ≈ 1 m
+
+    Return: geodataframe without duplicates
+    """
+    import pandas as pd
+    if len(res) == 0:
+        return res
+    keys = pd.Series([road_key(*r) for r in zip(res['name'],res['lcodes'],res['direction'])],index=res.index)
+    rounded = shapely.to_wkb(shapely.set_precision(res.geometry.values,10 ** -precision,mode='pointwise'))
+    dup = pd.DataFrame({'key':keys,'wkb':rounded}).duplicated().values
+    res = res[~dup].reset_index(drop=True)
+    keys = keys.values[~dup]
+    geoms = np.array(res.geometry.values)
+    
+    # candidate pairs of the same road
+    left,right = shapely.STRtree(geoms).query(geoms,predicate='dwithin',distance=tolerance)
+    pair = (left < right) & (keys[left] == keys[right])
+    left,right = left[pair],right[pair]
+    if len(left) == 0:
+        return res
+    
+    # length of each piece within tolerance of the other, in both directions
+    lengths = shapely.length(geoms)
+    shared_l = shapely.length(shapely.intersection(geoms[left],shapely.buffer(geoms[right],tolerance)))
+    shared_r = shapely.length(shapely.intersection(geoms[right],shapely.buffer(geoms[left],tolerance)))
+    covered_l = shared_l >= lengths[left] - tolerance  # left lies on right
+    covered_r = shared_r >= lengths[right] - tolerance
+    
+    drop = np.zeros(len(res),dtype=bool)
+    drop[left[covered_l]] = True
+    drop[right[covered_r & ~covered_l]] = True
+    
+    # pieces sharing more than the end caps of a mere contact overlap, union find over the rows of these pairs only
+    overlap = ~covered_l & ~covered_r & (np.maximum(shared_l,shared_r) > 2 * tolerance) & ~drop[left] & ~drop[right]
+    rows = np.unique(np.concatenate([left[overlap],right[overlap]]))
+    parent = np.arange(len(rows))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i,j in zip(np.searchsorted(rows,left[overlap]),np.searchsorted(rows,right[overlap])):
+        ri,rj = find(i),find(j)
+        if ri != rj:
+            parent[max(ri,rj)] = min(ri,rj)
+    roots = np.array([find(i) for i in range(len(rows))],dtype=np.int64)
+    
+    # every group is merged into its longest piece
+    order = np.argsort(roots,kind='stable')
+    starts = np.flatnonzero(np.r_[True,np.diff(roots[order]) != 0])
+    for members in np.split(rows[order],starts[1:]):
+        best = members[np.argmax(lengths[members])]
+        geoms[best] = shapely.line_merge(shapely.union_all(geoms[members]))
+        drop[members[members != best]] = True
+    keep = np.flatnonzero(~drop)
+    return res.iloc[keep].set_geometry(geoms[keep],crs=res.crs).reset_index(drop=True)
@@ -0,0 +1,123 @@
+"""
+*****************************************************************************************
+Coordinate transforms between wgs84 and gcj02 (the amap coordinate system), scalar and vectorized.
+Env: python 3.7
+*****************************************************************************************
+"""
+
+import numpy as np
+
+
+class TransformCoordinates(object):
+    # 坐标转化，主要用到 gcj02_wgs84()
+    # 标量接口（gcj02_wgs84 / wgs84_gcj02）是 *_array 向量化接口的简单封装
+    def __init__(self):
+        self.x_pi = 3.14159265358979324 * 3000.0 / 180.0
+        self.pi = 3.1415926535897932384626  # π
+        self.a = 6378245.0  # 长半轴
+        self.ee = 0.00669342162296594323  # 扁率
+
+    def gcj02_wgs84(self,lng, lat):
+        wlng,wlat = self.gcj02_wgs84_array(lng,lat)
+        return [float(wlng),float(wlat)]
+
+    def wgs84_gcj02(self,lng, lat):
+        mglng,mglat = self.wgs84_gcj02_array(lng,lat)
+        return [float(mglng),float(mglat)]
+
+    def gcj02_wgs84_array(self,lng,lat):
+        """ gcj02 -> wgs84 (one-step approximation), lng/lat: array-like, return (lng,lat) arrays
+        """
+        lng = np.asarray(lng,dtype=float)
+        lat = np.asarray(lat,dtype=float)
+        dlng,dlat = self.offset(lng,lat)
+        return lng - dlng, lat - dlat
+
+    def gcj02_wgs84_exact(self,lng,lat,tol=1e-9,max_iter=20):
+        wlng,wlat = self.gcj02_wgs84_exact_array(lng,lat,tol,max_iter)
+        return [float(wlng),float(wlat)]
+
+    def gcj02_wgs84_exact_array(self,lng,lat,tol=1e-9,max_iter=20):
+        """ gcj02 -> wgs84 by fixed-point iteration, lng/lat: array-like
+        Parameters
+        ----------
+        tol: stop when |wgs84_gcj02(result) - input| < tol (degree) for a point, 1e-9 ≈ 0.1 mm
+        max_iter: maximum iterations, only unconverged points are iterated again
+
+        Return: (lng,lat) arrays
+        """
+        lng = np.asarray(lng,dtype=float)
+        lat = np.asarray(lat,dtype=float)
+        shape = np.broadcast(lng,lat).shape
+        lng,lat = np.broadcast_to(lng,shape).ravel(),np.broadcast_to(lat,shape).ravel()
+        wlng,wlat = self.gcj02_wgs84_array(lng,lat)
+        idx = np.arange(lng.size)
+        for _ in range(max_iter):
+            glng,glat = self.wgs84_gcj02_array(wlng[idx],wlat[idx])
+            rlng,rlat = glng - lng[idx],glat - lat[idx]
+            wlng[idx] -= rlng
+            wlat[idx] -= rlat
+            idx = idx[(np.abs(rlng) >= tol) | (np.abs(rlat) >= tol)]
+            if idx.size == 0:
+                break
+        return wlng.reshape(shape),wlat.reshape(shape)
+
+    def wgs84_gcj02_array(self,lng,lat):
+        """ wgs84 -> gcj02, lng/lat: array-like, return (lng,lat) arrays
+        """
+        lng = np.asarray(lng,dtype=float)
+        lat = np.asarray(lat,dtype=float)
+        dlng,dlat = self.offset(lng,lat)
+        return lng + dlng, lat + dlat
+
+    def offset(self,lng,lat):
+        """ gcj02 offset (dlng,dlat) in degrees at wgs84 lng/lat, vectorized
+        """
+        dlat = self.transformlat(lng - 105.0, lat - 35.0)
+        dlng = self.transformlng(lng - 105.0, lat - 35.0)
+        radlat = lat / 180.0 * self.pi
+        magic = np.sin(radlat)
+        magic = 1 - self.ee * magic * magic
+        sqrtmagic = np.sqrt(magic)
+        dlat = (dlat * 180.0) / ((self.a * (1 - self.ee)) / (magic * sqrtmagic) * self.pi)
+        dlng = (dlng * 180.0) / (self.a / sqrtmagic * np.cos(radlat) * self.pi)
+        return dlng,dlat
+
+    def transformlat(self,lng, lat):
+        ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + 0.1 * lng * lat + 0.2 * np.sqrt(np.fabs(lng))
+        ret += (20.0 * np.sin(6.0 * lng * self.pi) + 20.0 *  np.sin(2.0 * lng * self.pi)) * 2.0 / 3.0
+        ret += (20.0 * np.sin(lat * self.pi) + 40.0 * np.sin(lat / 3.0 * self.pi)) * 2.0 / 3.0
+        ret += (160.0 * np.sin(lat / 12.0 * self.pi) + 320 * np.sin(lat * self.pi / 30.0)) * 2.0 / 3.0
+        return ret
+
+    def transformlng(self,lng, lat):
+        ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + 0.1 * lng * lat + 0.1 * np.sqrt(np.fabs(lng))
+        ret += (20.0 * np.sin(6.0 * lng * self.pi) + 20.0 * np.sin(2.0 * lng * self.pi)) * 2.0 / 3.0
+        ret += (20.0 * np.sin(lng * self.pi) + 40.0 * np.sin(lng / 3.0 * self.pi)) * 2.0 / 3.0
+        ret += (150.0 * np.sin(lng / 12.0 * self.pi) + 300.0 * np.sin(lng / 30.0 * self.pi)) * 2.0 / 3.0
+        return ret
+
+    def transform(self,lng,lat,tctype='_wgs84',tol=1e-9,max_iter=20):
+        """ array version of coordinates(), lng/lat: array-like, return (lng,lat) arrays
+        tol, max_iter: convergence of the iterative inverse, '_wgs84_exact' only
+        """
+        if tctype == '_wgs84':
+            return self.gcj02_wgs84_array(lng,lat)
+        elif tctype == '_wgs84_exact':
+            return self.gcj02_wgs84_exact_array(lng,lat,tol=tol,max_iter=max_iter)
+        elif tctype == '_gcj02':
+            return self.wgs84_gcj02_array(lng,lat)
+        else:
+            raise ValueError('Check parameters.')
+
+    def coordinates(self,c,tctype='_wgs84'):
+        lng,lat = c.split(',')
+        lng,lat = float(lng),float(lat)
+        if tctype == '_wgs84':
+            wlng,wlat = self.gcj02_wgs84(lng,lat)
+        elif tctype == '_wgs84_exact':
+            wlng,wlat = self.gcj02_wgs84_exact(lng,lat)
+        elif tctype == '_gcj02':
+            wlng,wlat = self.wgs84_gcj02(lng,lat)
+        else: print('Check parameters.')
+        return wlng,wlat